@@ -35,25 +35,23 @@
 
 from math import *
 import re
+from binascii import hexlify, unhexlify
+
+try:
+  import numpy
+except ImportError: # Only the packed and batch engines need it.
+  numpy = None
 
 def A000120(n):
   '''Number of 1-bits in the binary expansion of n.'''
-  i = 0
-  while 0 != n:
-    i += (n&1)
-    n >>= 1
-  return(i)
+  return(bin(n).count('1'))
 
 
 # floor(log(n)/log(2)) does not return correct results after n grows over certain limit!
 
 def A000523(n):
   '''Log_2(n) rounded down. We return -1 for n=0, although -infinity would be correct.'''
-  i = -1
-  while 0 != n:
-    i += 1
-    n >>= 1
-  return(i)
+  return(n.bit_length()-1)
 
 def A007088(n):
   '''Converts n to binary form. Or equally: nth decimal number using no other digits than 0 and 1.'''
@@ -75,6 +73,59 @@ def A079946(n):
 
 def A030101(a):
   '''Reverse a's binary expansion.'''
+  if 0 == a: return(a)
+  return(int(bin(a)[:1:-1],2))
+
+
+complement_bits = bytearray(range(256)) # Translation table swapping '0' and '1'.
+complement_bits[ord('0')] = ord('1')
+complement_bits[ord('1')] = ord('0')
+
+def A036044(a):
+  '''Reverse and complement a totally balanced binary string.'''
+  if 0 == a: return(a)
+  return(int(bin(a)[:1:-1].translate(str(complement_bits)),2))
+
+
+# With n & -n isolating the lowest 1-bit of n (and 0 for n=0):
+
+def A000265(n):
+  '''Largest odd divisor of n; or odd part of n.'''
+  if 0 == n: return(n)
+  return(n >> A007814(n))
+
+def A006519(n):
+  '''Highest power of 2 dividing n: 1,2,1,4,1,2,1,8,1,2,1,4,1,2,1,16,...'''
+  return(n & -n)
+
+def A007814(n):
+  '''Exponent of highest power of 2 dividing n (the binary carry sequence).'''
+  if 0 == n: return(n)
+  return((n & -n).bit_length()-1)
+
+def A036987(n):
+  '''Fredholm-Rueppel sequence. a(n)=1 iff n = 2^m - 1.'''
+  if 0 == (n & (n+1)): return(1)
+  else: return(0)
+
+
+# The original bit-at-a-time versions of the above, kept for comparison:
+
+def A000120_loop(n):
+  i = 0
+  while 0 != n:
+    i += (n&1)
+    n >>= 1
+  return(i)
+
+def A000523_loop(n):
+  i = -1
+  while 0 != n:
+    i += 1
+    n >>= 1
+  return(i)
+
+def A030101_loop(a):
   b = 0
   while 0 != a:
      b <<= 1
@@ -82,9 +133,7 @@ def A030101(a):
      a >>= 1
   return(b)
 
-
-def A036044(a):
-  '''Reverse and complement a totally balanced binary string.'''
+def A036044_loop(a):
   b = 0
   while 0 != a:
      b <<= 1
@@ -92,15 +141,12 @@ def A036044(a):
      a >>= 1
   return(b)
 
-
-def A000265(n):
-  '''Largest odd divisor of n; or odd part of n.'''
+def A000265_loop(n):
   if 0 == n: return(n)
   while 0 == (n%2): n >>= 1
   return(n)
 
-def A006519(n):
-  '''Highest power of 2 dividing n: 1,2,1,4,1,2,1,8,1,2,1,4,1,2,1,16,...'''
+def A006519_loop(n):
   if 0 == n: return(n)
   p = 1
   while 0 == (n%2):
@@ -108,8 +154,7 @@ def A006519(n):
     p <<= 1
   return(p)
 
-def A007814(n):
-  '''Exponent of highest power of 2 dividing n (the binary carry sequence).'''
+def A007814_loop(n):
   if 0 == n: return(n)
   p = 0
   while 0 == (n%2):
@@ -117,10 +162,41 @@ def A007814(n):
     p += 1
   return(p)
 
-def A036987(n):
-  '''Fredholm-Rueppel sequence. a(n)=1 iff n = 2^m - 1.'''
-  if 0 == (n & (n+1)): return(1)
-  else: return(0)
+
+def bench_bit_kernels(maxbits=1<<20,maxsecs=2.0):
+  '''For operand sizes of 8, 64, 512, ... bits and finally maxbits, compare each of the functions
+     above with its _loop version, checking that they agree, and printing the times per call.
+     Each loop version is dropped after it alone has taken more than maxsecs for one size.'''
+  from time import time
+  from random import getrandbits, seed
+  seed(80069)
+
+  names = ['A000120','A000523','A030101','A036044','A000265','A006519','A007814']
+  sizes = [8]
+  while 8*sizes[-1] < maxbits: sizes.append(8*sizes[-1])
+  if sizes[-1] < maxbits: sizes.append(maxbits)
+
+  slow = set()
+  for bits in sizes:
+    args = []
+    for i in range(8):
+      n = getrandbits(bits) | (1 << (bits-1))
+      if i&1: n = (n >> (bits//2)) << (bits//2) # Some with a long tail of zeros.
+      args.append(n)
+    for name in names:
+      fast = globals()[name]
+      t = time()
+      res = [fast(n) for n in args]
+      t1 = (time()-t)/len(args)
+      line = '%8d bits %s: %.3g s' % (bits,name,t1)
+      if name not in slow:
+        t = time()
+        ref = [globals()[name+'_loop'](n) for n in args]
+        t2 = (time()-t)/len(args)
+        if res != ref: line += ' MISMATCH!'
+        line += ', loop %.3g s, %.1f x' % (t2,t2/max(t1,1e-9))
+        if t2*len(args) > maxsecs: slow.add(name)
+      print line
 
 
 def jacobi_symbol(p,q):
@@ -145,25 +221,92 @@ def jacobi_symbol(p,q):
   else: return(1-(s&2)) # p=1
 
 
+# The quadratic residues modulo an odd prime p, computed once by squaring
+# 1 .. (p-1)/2 and kept as a pair (flags,bits), where flags is a bytearray
+# of p bytes with flags[k] = 1 iff k is a nonzero quadratic residue mod p,
+# and bits is the same as an integer, doubled (bits k and k+p both set),
+# so that any window of at most p bits can be shifted out of it at once.
+# The most recently used tables are kept in legendre_tables, until their
+# total size would exceed legendre_tables_max_bytes, after which the
+# least recently used ones are dropped, and recomputed if needed again.
+
+from collections import OrderedDict
+
+legendre_tables = OrderedDict()
+legendre_tables_max_bytes = 1 << 24
+legendre_tables_stats = { 'hits' : 0, 'misses' : 0, 'evictions' : 0 }
+
+def legendre_table_bytes(p): return(p + (p // 4))
+
+digits01 = bytearray(range(256)) # For translating bytes 0 and 1 to '0' and '1'.
+digits01[0] = ord('0')
+digits01[1] = ord('1')
+digits01 = str(digits01)
+
+
+def legendre_table(p):
+  '''Return the pair (flags,bits) of quadratic residues modulo an odd prime p, see above.'''
+  if p in legendre_tables:
+    legendre_tables_stats['hits'] += 1
+    tab = legendre_tables.pop(p)
+    legendre_tables[p] = tab # Now the most recently used.
+    return(tab)
+
+  legendre_tables_stats['misses'] += 1
+  flags = bytearray(p)
+  sq = 0
+  for k in xrange(1,(p+1)//2): # k^2 = (k-1)^2 + 2k-1.
+    sq += k+k-1
+    if sq >= p: sq -= p
+    flags[sq] = 1
+
+  digits = str(flags).translate(digits01)[::-1]
+  bits = int(digits+digits,2)
+
+  total = legendre_table_bytes(p)
+  for q in legendre_tables.keys():
+    total += legendre_table_bytes(q)
+  while legendre_tables and total > legendre_tables_max_bytes:
+    (q,oldtab) = legendre_tables.popitem(last=False)
+    total -= legendre_table_bytes(q)
+    legendre_tables_stats['evictions'] += 1
+
+  legendre_tables[p] = (flags,bits)
+  return((flags,bits))
+
+
+def legendre_symbol(n,p):
+  '''Legendre symbol L(n/p) for an odd prime p, by a table lookup.'''
+  n %= p
+  if 0 == n: return(0)
+  elif legendre_table(p)[0][n]: return(1)
+  else: return(-1)
+
+
+def quadratic_residue_window(p,start,width):
+  '''Return a width-bit integer whose bit j is 1 iff start+j is a nonzero quadratic residue mod p.'''
+  bits = legendre_table(p)[1]
+  s = 0
+  j = 0
+  start %= p
+  while j < width:
+    w = min(width-j,p)
+    s |= ((bits >> start) & ((1 << w)-1)) << j
+    j += w
+  return(s)
+
+
 def A165471(n):
   '''Legendre symbol L(n/65537).'''
-  return(jacobi_symbol(n,65537))
+  return(legendre_symbol(n,65537))
 
 def oneplushalved(n): return((n+1)/2)
 
 def A179416(n): return(oneplushalved(A165471(1+(n%65536))))
 
 def A179417(n):
-  ul = 1+(2*n)
-  i = n*n
-  j = 0
-  s = 0
-  while j<ul:
-    if(1==oneplushalved(A165471(1+i))): s += 2**j
-    i += 1
-    j += 1
-
-  return(s)
+  '''Bits 1+n^2 .. 1+n^2+2n of the characteristic function of the quadratic residues mod 65537, A179416.'''
+  return(quadratic_residue_window(65537,1+(n*n),1+(2*n)))
 
 
 def A179418(n): return(A000120(A179417(n)))
@@ -171,7 +314,46 @@ def A179418(n): return(A000120(A179417(n)))
 
 ## Note: A125974(10) should return 12, not 4!
 def A125974(n):
-  '''Function whose restriction to A014486 induces Kreweras bijection A125976.'''
+  '''Function whose restriction to A014486 induces Kreweras bijection A125976.
+     Computes the same as A125974_loop below, where chosen and others are always
+     n shifted right by some amount, so here they are just positions in the binary
+     expansion of n, and each skip over a run is a lookup from the table runend,
+     made in one pass over the bits. The result is collected as a string of bits.'''
+  if 0 == n: return(n)
+
+  bits = bin(n)[:1:-1] + '00' # Least significant bit first, with zeros past the end.
+  top = len(bits)-2
+
+# runend[k] = the position after the run of equal bits containing bit k:
+  runend = [top]*(top+1)
+  for k in xrange(top-2,-1,-1):
+    if bits[k] == bits[k+1]: runend[k] = runend[k+1]
+    else: runend[k] = k+1
+
+  if '0' == bits[0]: (chosen,others) = (runend[0],0) # Get rid of lsb-0's, or lsb-1's.
+  else:              (chosen,others) = (0,runend[0])
+  b = ord(bits[0])-48
+  out = bytearray()
+
+  while (chosen < top) or (others < top):
+    out.append(48+b)
+    if (chosen >= top-1) or (('0' == bits[chosen]) and (top == runend[chosen+1])): # Last one or zero at hand.
+       chosen = others
+       others = top
+       b = 1-b
+    elif bits[chosen] == bits[chosen+1]: # Source run continues, dest changes.
+       (chosen,others) = (others,chosen+1)
+       b = 1-b
+    else: # Source run changes, skip past the next run.
+       chosen = runend[chosen+1]
+
+  if 0 == len(out): return(0)
+  return(int(str(out[::-1]),2))
+
+
+# The original version of A125974, kept for comparison:
+
+def A125974_loop(n):
   if 0 == n: return(n)
 
   chosen = A000265(n)         # Initially ones, get rid of lsb-0's.
@@ -204,6 +386,26 @@ def A125974(n):
   return(s)
 
 
+def bench_A125974(upto_n,checkupto=1<<16):
+  '''Check that A125974 and A125974_loop agree on 0 .. checkupto-1 (including A125974(10) = 12,
+     see the note above), and on the first upto_n rows of genA0new3, and time both on those rows.'''
+  from time import time
+
+  bad = [n for n in xrange(checkupto) if A125974(n) != A125974_loop(n)]
+  print 'A125974(10) = ' + str(A125974(10)) + ', A125974_loop(10) = ' + str(A125974_loop(10))
+  print 'Differences below ' + str(checkupto) + ': ' + str(bad[:10])
+
+  rows = take(upto_n,genA0new3())
+  t = time()
+  res1 = [A125974(a) for a in rows]
+  t1 = time()-t
+  t = time()
+  res2 = [A125974_loop(a) for a in rows]
+  t2 = time()-t
+  print ('A125974: ' + str(t1) + ' s, A125974_loop: ' + str(t2) + ' s, speed-up '
+         + str(t2/max(t1,1e-9)) + ', same results: ' + str(res1 == res2))
+
+
 def tb_A057164(a):
   return(A036044(a))
 
@@ -286,172 +488,1419 @@ def tb_A057117(a):
 
 def tb_A082356(a):
   '''Implement the gatomorphism A082356 on A014486-codes.
-     Keep two "parallel" stacks, the other for the reconstructed
-     totally balanced binary strings, and the other for their
-     corresponding sizes.
-     Start scanning the argument "a" as base-4 number, from the
-     least-significant end, ...
-     See the function quatexpA->parenthesization in gatorank.scm
+     Scan the argument "a" as base-4 number, from the
+     least-significant end, building the tree with a stack machine,
+     see quaternary_stack_machine below,
+     and the function quatexpA->parenthesization in gatorank.scm
      and http://www.research.att.com/~njas/sequences/A085184'''
+  return(bitbuf_to_int(quaternary_stack_machine(int_to_bitbuf(a),A082356_actions)))
 
-  if(0 == a): return(a)
 
-  a >>= 1 # Discard the least-significant bit (0) before starting.
 
-  tree_stack = [4] # The last two leaves are implicit, 100 in binary.
-  size_stack = [3] # And their total size in bits is 3.
+def tb_A074684(a):
+  '''Implement the gatomorphism A074684 on A014486-codes. A variant of above,
+     with the roles of 01 and 10 swapped, see quatexpB->parenthesization.'''
+  return(bitbuf_to_int(quaternary_stack_machine(int_to_bitbuf(a),A074684_actions)))
 
 
-  while (a > 2):
-     if(0 == (a&3)): # Double-zeros stand for double-leaves (\/), just push them to stack.
-         leftchild  = 0
-         leftsize   = 1
-         rightchild = 0
-         rightsize  = 1
 
-     elif(1 == (a&3)): # (case 01)
-         rightchild = tree_stack.pop()
-         rightsize  = size_stack.pop()
-         leftchild  = 0
-         leftsize   = 1
+def tb_A082358(a):
+  '''Implement the gatomorphism A082358 on A014486-codes. A variant of above.'''
+  return(tb_A057163(tb_A082356(a)))
 
-     elif(2 == (a&3)): # (case 10)
-         rightchild = 0
-         rightsize  = 1
-         leftchild  = tree_stack.pop()
-         leftsize   = size_stack.pop()
+def tb_A082360(a):
+  '''Implement the gatomorphism A082360 on A014486-codes. A variant of above ones.'''
+  return(tb_A057163(tb_A074684(a)))
 
-     else: # It's 3 (case 11), join two branches in normal order.
-         leftchild  = tree_stack.pop()
-         leftsize   = size_stack.pop()
-         rightchild = tree_stack.pop()
-         rightsize  = size_stack.pop()
 
-     size_stack.append(1+leftsize+rightsize)
-     tree_stack.append((1 << (leftsize+rightsize)) + (leftchild << rightsize) + rightchild)
+# (same-intfuns? A082358 (compose-funs A057163 A057117) 2055) --> 56
+# I.e., are up to n=55 identical. Let's use that fact...
 
-     a >>= 2 # Next digit in base-4.
+def tb_Anewgm1(a):
+  '''Implement a new Cat. bijection on A014486-codes.'''
+  return(tb_A057163(tb_A057117(a)))
 
-  return(tree_stack.pop() >> 1) # Discard the last leaf by halving.
 
+# Memoized reflection. The trees iterated by genA122232, genA1new0, etc.
+# contain many identical subtrees, within a row and from one row to the
+# next (A079946 makes the whole previous tree a subtree of the next one).
+# bb_A057163_memo hash-conses the tree bottom-up: each internal node gets
+# an id from the pair of the ids of its subtrees (the leaf is 0), kept in
+# subtree_ids, so that identical subtrees, wherever they occur, get the
+# same id in constant time per node. The id of the reflection of each node
+# is kept in subtree_reflections, computed from those of its subtrees when
+# the node is first seen, so a repeated subtree is reflected only once,
+# and one call takes time linear in the length of the tree.
+# When there are more than subtree_memo_max_nodes nodes, the tables are
+# emptied before the next call (the statistics are kept, and clears counted).
+# This flush-all policy was chosen over evicting the least recently used
+# subtrees, e.g. with an OrderedDict: the ids of evicted nodes could still
+# be referred to by the nodes above them, and the bookkeeping would cost
+# more than the sharing saves. As the whole previous tree is a subtree of
+# the next one, the tables are refilled in a row or two anyway.
+# Note that in pure Python this is still 3-8 times slower than tb_A057163_bb
+# (see measure_subtree_sharing), even with hit ratios of 66-99 %, as every
+# node costs a dictionary lookup and some tuples, where tb_A057163_bb just
+# moves bytes. So use_subtree_memo makes every generator slower, and is
+# off by default, kept for measuring how much the subtrees are shared.
+# With use_subtree_memo set, step_map uses it for every tb_A057163 stage
+# that is not part of a fused kernel, or it can be asked for explicitly,
+# e.g. step_map(A079946,tb_A057163_memo,A125974,tb_A057163_memo).
+# (tb_A057117_aux recurses over the rows of the level-order code, not over
+# subtrees, so its results cannot be shared like this.)
+
+subtree_ids = {} # (id of the left subtree, id of the right subtree) -> id
+subtree_nodes = [None] # id -> (left id, right id), None for the leaf.
+subtree_reflections = [0] # id -> id of the reflected subtree.
+subtree_memo_max_nodes = 1 << 22
+subtree_memo_stats = { 'hits' : 0, 'misses' : 0, 'clears' : 0 }
+use_subtree_memo = False
+
+def subtree_memo_clear():
+  '''Empty the hash-consing tables, keeping their statistics.'''
+  subtree_ids.clear()
+  del subtree_nodes[1:]
+  del subtree_reflections[1:]
+
+
+def subtree_memo_reset():
+  '''Empty the hash-consing tables and zero their statistics.'''
+  subtree_memo_clear()
+  for k in subtree_memo_stats.keys(): subtree_memo_stats[k] = 0
+
+
+def subtree_node(l,r):
+  '''Return the id of the node with subtrees l and r, giving it a new one if needed.'''
+  i = subtree_ids.get((l,r))
+  if i is None:
+    i = len(subtree_nodes)
+    subtree_ids[(l,r)] = i
+    subtree_nodes.append((l,r))
+    subtree_reflections.append(None)
+  return(i)
 
 
-def tb_A074684(a):
-  '''Implement the gatomorphism A074684 on A014486-codes. A variant of above.'''
+def bb_A057163_memo(buf):
+  '''Bit-buffer version of tb_A057163, sharing the reflections of identical subtrees.'''
+  if len(subtree_nodes) > subtree_memo_max_nodes:
+    subtree_memo_clear()
+    subtree_memo_stats['clears'] += 1
+
+  ids = subtree_ids
+  refl = subtree_reflections
+  hits = 0
+  misses = 0
+# Read the preorder backwards, with the implicit last leaf first, so that
+# both subtrees of a node are on the stack (left one on the top) when it is reached:
+  stack = [(0,0)] # (id, id of the reflection)
+  for b in reversed(buf):
+    if 48 == b:
+      stack.append((0,0))
+      continue
+    (l,rl) = stack.pop()
+    (r,rr) = stack.pop()
+    i = ids.get((l,r))
+    if i is None:
+      misses += 1
+      i = subtree_node(l,r)
+      ri = subtree_node(rr,rl)
+      refl[i] = ri
+      refl[ri] = i
+    else:
+      hits += 1
+    stack.append((i,refl[i]))
+  subtree_memo_stats['hits'] += hits
+  subtree_memo_stats['misses'] += misses
+
+# Write out the preorder of the reflected tree:
+  nodes = subtree_nodes
+  out = bytearray()
+  todo = [stack.pop()[1]]
+  while todo:
+    i = todo.pop()
+    if 0 == i: out.append(48)
+    else:
+      out.append(49)
+      (l,r) = nodes[i]
+      todo.append(r)
+      todo.append(l)
+  del out[-1] # The implicit last leaf.
+  return(out)
+
+
+def tb_A057163_memo(a):
+  '''Same as tb_A057163, computed with bb_A057163_memo.'''
+  return(bitbuf_to_int(bb_A057163_memo(int_to_bitbuf(a))))
+
+
+def measure_subtree_sharing(gen,upto_n):
+  '''Reflect the first upto_n terms of gen with tb_A057163_memo, starting with empty
+     tables, and print the time taken, the memo statistics and the time taken by tb_A057163_bb.'''
+  from time import time
+
+  rows = take(upto_n,gen)
+  subtree_memo_reset()
+  t = time()
+  res1 = [tb_A057163_memo(a) for a in rows]
+  t1 = time()-t
+  t = time()
+  res2 = [tb_A057163_bb(a) for a in rows]
+  t2 = time()-t
+  stats = subtree_memo_stats
+  print ('tb_A057163_memo: ' + str(t1) + ' s, tb_A057163_bb: ' + str(t2) + ' s, same results: ' + str(res1 == res2))
+  print ('hits ' + str(stats['hits']) + ', misses ' + str(stats['misses']) + ', hit ratio '
+         + str(float(stats['hits'])/max(1,stats['hits']+stats['misses'])) + ', clears '
+         + str(stats['clears']) + ', nodes ' + str(len(subtree_nodes)-1))
 
-  if(0 == a): return(a)
 
-  a >>= 1 # Discard the least-significant bit (0) before starting.
+########################################################################
+#
+# Bit-buffer versions of the above, for very long rows.
+#
+# The functions above consume their argument with a >>= 1 and build
+# every subtree with shifts and additions, so on a row of N bits each
+# step copies the whole bigint, and one call costs O(N^2).
+# Here a binary string is kept in a bytearray, one byte ('0' or '1')
+# per bit, the most significant bit first, without the implicit last leaf.
+# Conversions to and from Python integers go through bin() and int(s,2),
+# which are linear in CPython, and the tree walks are done with
+# explicit preallocated stacks, so each call is O(N).
+#
+########################################################################
 
-  tree_stack = [4] # The last two leaves are implicit, 100 in binary.
-  size_stack = [3] # And their total size in bits is 3.
 
+def int_to_bitbuf(n):
+  '''Return the binary expansion of n as a bytearray of '0' and '1' characters.'''
+  if 0 == n: return(bytearray())
+  return(bytearray(bin(n)[2:]))
+
+def bitbuf_to_int(buf):
+  '''Inverse of int_to_bitbuf.'''
+  if 0 == len(buf): return(0)
+  return(int(str(buf),2))
+
+
+def bb_A057164(buf):
+  '''Bit-buffer version of tb_A057164: reverse and complement.'''
+  return(buf[::-1].translate(complement_bits))
+
+def bb_A079946(buf):
+  '''Bit-buffer version of A079946: surround with 1...0.'''
+  return(bytearray('1') + buf + bytearray('0'))
+
+
+def reflected_postorder(src,one,n,tail):
+  '''Return the postorder of the tree whose preorder (without the implicit
+     last leaf) is given by the n bytes of iterable src, where byte one stands
+     for an internal node, followed by the bytes of tail.
+     The postorder is produced in a single pass over the preorder, keeping
+     only one flag per pending internal node: whether its left subtree is done.'''
+
+  pending = [0]*(n+1) # Preallocated stack of pending internal nodes.
+  sp = 0
+  post = bytearray(n+1)
+  q = 0
+
+  for c in src:
+     if(one == c): # An internal node, its subtrees still to come.
+        pending[sp] = 0
+        sp += 1
+     else: # A leaf. Output it and all the internal nodes it completes.
+        post[q] = 48
+        q += 1
+        while sp:
+           if pending[sp-1]:
+              sp -= 1
+              post[q] = 49
+              q += 1
+           else:
+              pending[sp-1] = 1 # The left subtree is now complete.
+              break
+
+# Then the implicit last leaf, which completes all the rest:
+  post[q] = 48
+  q += 1
+  while sp and pending[sp-1]:
+     sp -= 1
+     post[q] = 49
+     q += 1
+
+  post[q:] = tail
+  return(post)
+
+
+def bb_A057163(buf,wrap=0):
+  '''Bit-buffer version of tb_A057163, bit-identical with it on A014486-codes.
+     The preorder of the reflected tree is the reverse of the postorder of
+     the original tree. If wrap is 1, return A079946 of the result instead.'''
+
+  if wrap: return(reflected_postorder(buf,49,len(buf),bytearray('1'))[::-1])
+# The postorder always starts with a leaf, which after the reversal is
+# the implicit last leaf of the result, so leave it out:
+  return(reflected_postorder(buf,49,len(buf),bytearray())[:0:-1])
+
+def tb_A057163_bb(a):
+  '''Same as tb_A057163, computed in linear time with bb_A057163.'''
+  return(bitbuf_to_int(bb_A057163(int_to_bitbuf(a))))
+
+
+def bb_A057117(buf,mirror=0,wrap=0):
+  '''Bit-buffer version of tb_A057117, without recursion.
+     The argument is read as a binary tree listed breadth-first, where
+     the children of the k:th 1-bit (zero-based) are at positions 2k+1
+     and 2k+2, and anything past the end of buf is a leaf.
+     (This is what tb_A057117_aux computes with its row widths.)
+     The ranks of the 1-bits are taken from a prefix sum, and the tree is
+     then output depth-first with an explicit stack of positions.
+     With mirror=1 the right subtrees are output first, giving
+     tb_A057163 of the result, and with wrap=1 the result is
+     surrounded with 1...0 as by A079946.'''
+
+  n = len(buf)
+  rank = [0]*n # rank[p] = number of 1-bits in buf before position p.
+  ones = 0
+  for p in range(n):
+     rank[p] = ones
+     if(49 == buf[p]): ones += 1
+
+  stack = [0]*(ones+2) # Room for every node that can be pending at once.
+  sp = 1 # The root at position 0 is already there.
+  out = bytearray(2*ones+1+wrap)
+  out[0] = 49 # Only matters if wrap is 1.
+  q = wrap
+
+  while sp:
+     sp -= 1
+     p = stack[sp]
+     if (p < n) and (49 == buf[p]):
+        out[q] = 49
+        c = 2*rank[p] + 1
+        stack[sp] = c+1-mirror # Right child is visited after the left one,
+        stack[sp+1] = c+mirror # unless mirrored.
+        sp += 2
+     else:
+        out[q] = 48
+     q += 1
+
+  if wrap: return(out[:q]) # The last leaf is then the final 0 of A079946.
+  return(out[:q-1]) # Discard the last leaf.
+
+def tb_A057117_bb(a):
+  '''Same as tb_A057117, computed in linear time with bb_A057117.'''
+  return(bitbuf_to_int(bb_A057117(int_to_bitbuf(a))))
+
+
+# Action tables for quaternary_stack_machine, indexed by the base-4 digit.
+# Each entry tells whether the left and the right subtree of the new node
+# are popped from the stack (1) or are leaves (0). When both are popped,
+# the left one is popped first.
+
+A082356_actions = ((0,0), # 00: Double-leaves (\/).
+                   (0,1), # 01: Right subtree from the stack.
+                   (1,0), # 10: Left subtree from the stack.
+                   (1,1)) # 11: Join two branches in normal order.
+
+A074684_actions = ((0,0),(1,0),(0,1),(1,1)) # 01 and 10 swapped.
+
+
+def quaternary_stack_machine(buf,actions,mirror=0,wrap=0):
+  '''Decode a bit buffer with the base-4 stack machine of tb_A082356 and tb_A074684.
+     After the least significant bit (0) is discarded, the rest of buf is read
+     as base-4 digits from the least significant end, and each digit creates
+     a new internal node whose subtrees are leaves or popped from the stack,
+     as told by actions. Initially the stack contains the implicit last two
+     leaves (100 in binary), and the most significant digit is processed
+     only if it is 3. Instead of joining bigints, the nodes are recorded in
+     preallocated child arrays, and the result is written out depth-first.
+     Arguments mirror and wrap are as in bb_A057117.'''
+
+  n = len(buf)-1
+  if n < 0:
+    if wrap: return(bytearray('10'))
+    return(bytearray())
+
+# Split the digits into their low and high bits, least significant digit first:
+  rev = buf[n-1::-1] if n > 0 else bytearray()
+  lows  = rev[0::2]
+  highs = rev[1::2]
+  if len(highs) < len(lows): highs.append(48) # Odd number of bits, top digit is 01.
+  count = len(lows)
+  if (count > 0) and (3 != ((lows[-1]-48)+2*(highs[-1]-48))): count -= 1
+
+  left  = [-1]*(count+1) # Children of each node, -1 for a leaf.
+  right = [-1]*(count+1)
+  stack = [0]*(count+1)
+  sp = 1 # Node 0, with two leaves, is the implicit 100.
+
+  k = 1
+  while k <= count:
+     (popleft,popright) = actions[(lows[k-1]-48)+2*(highs[k-1]-48)]
+     if popleft:
+        sp -= 1
+        left[k] = stack[sp]
+     if popright:
+        sp -= 1
+        right[k] = stack[sp]
+     stack[sp] = k
+     sp += 1
+     k += 1
+
+# Then output the tree on the top of the stack in preorder:
+  if mirror: (left,right) = (right,left)
+  out = bytearray(2*count+3+wrap)
+  out[0] = 49 # Only matters if wrap is 1.
+  q = wrap
+  pending = [0]*(count+3)
+  pending[0] = stack[sp-1]
+  sp = 1
+  while sp:
+     sp -= 1
+     k = pending[sp]
+     if k < 0:
+        out[q] = 48
+     else:
+        out[q] = 49
+        pending[sp] = right[k]
+        pending[sp+1] = left[k]
+        sp += 2
+     q += 1
+
+  if wrap: return(out[:q])
+  return(out[:q-1]) # Discard the last leaf.
 
-  while (a > 2):
-     if(0 == (a&3)): # Double-zeros stand for double-leaves (\/), just push them to stack.
-         leftchild  = 0
-         leftsize   = 1
-         rightchild = 0
-         rightsize  = 1
 
-     elif(1 == (a&3)): # (case 01)
-         rightchild = 0
-         rightsize  = 1
-         leftchild  = tree_stack.pop()
-         leftsize   = size_stack.pop()
+########################################################################
+#
+# Fused step kernels.
+#
+# The generators below iterate compositions like A079946(tb_A082358(i)),
+# which is A079946(tb_A057163(tb_A082356(i))), three full passes, each
+# producing a new bigint. Here such a composition is computed by one
+# kernel making a single pass over the bit buffer: tb_A057163 becomes
+# the order in which the other gatomorphism writes out its result
+# (mirror=1), and A079946 an extra 1 in front of the result and keeping
+# the last leaf as its 0 (wrap=1). The composition tb_A057163(A079946(x))
+# is just 10 followed by tb_A057163(x), and tb_A057164 is reading the
+# argument backwards, with 0's and 1's swapped.
+#
+# step_map(f,g,...) returns a function computing f(g(...(i))) on integers,
+# using the kernel registered in fused_steps for that composition, if any.
+#
+########################################################################
 
-     elif(2 == (a&3)): # (case 10)
-         rightchild = tree_stack.pop()
-         rightsize  = size_stack.pop()
-         leftchild  = 0
-         leftsize   = 1
 
-     else: # It's 3 (case 11), join two branches in normal order.
-         leftchild  = tree_stack.pop()
-         leftsize   = size_stack.pop()
-         rightchild = tree_stack.pop()
-         rightsize  = size_stack.pop()
+def bb_A057163_A079946_A057164(buf):
+  '''Compute tb_A057163(A079946(tb_A057164(x))) in one pass over the bit buffer of x.'''
+  return(reflected_postorder(reversed(buf),48,len(buf),bytearray('01'))[:0:-1])
+
+
+# Gatomorphisms that are compositions of others, innermost last:
+composite_steps = {
+  'tb_A082358' : ('tb_A057163','tb_A082356'),
+  'tb_A082360' : ('tb_A057163','tb_A074684'),
+  'tb_Anewgm1' : ('tb_A057163','tb_A057117'),
+}
+
+# Bit-buffer versions used when there is no fused kernel for the whole composition:
+bitbuf_steps = {
+  'A079946'    : bb_A079946,
+  'tb_A057163' : bb_A057163,
+  'tb_A057163_memo' : bb_A057163_memo,
+  'tb_A057164' : bb_A057164,
+  'tb_A057117' : bb_A057117,
+  'tb_A082356' : lambda buf: quaternary_stack_machine(buf,A082356_actions),
+  'tb_A074684' : lambda buf: quaternary_stack_machine(buf,A074684_actions),
+}
+
+# Fused kernels, keyed by the names of the composed functions, outermost first:
+fused_steps = {
+  ('tb_A057163','A079946','tb_A057164') : bb_A057163_A079946_A057164,
+  ('A079946','tb_A057163')              : lambda buf: bb_A057163(buf,1),
+  ('A079946','tb_A057117')              : lambda buf: bb_A057117(buf,0,1),
+  ('tb_A057163','tb_A057117')           : lambda buf: bb_A057117(buf,1,0),
+  ('A079946','tb_A057163','tb_A057117') : lambda buf: bb_A057117(buf,1,1),
+  ('tb_A057163','tb_A082356')           : lambda buf: quaternary_stack_machine(buf,A082356_actions,1,0),
+  ('A079946','tb_A082356')              : lambda buf: quaternary_stack_machine(buf,A082356_actions,0,1),
+  ('A079946','tb_A057163','tb_A082356') : lambda buf: quaternary_stack_machine(buf,A082356_actions,1,1),
+  ('tb_A057163','tb_A074684')           : lambda buf: quaternary_stack_machine(buf,A074684_actions,1,0),
+  ('A079946','tb_A074684')              : lambda buf: quaternary_stack_machine(buf,A074684_actions,0,1),
+  ('A079946','tb_A057163','tb_A074684') : lambda buf: quaternary_stack_machine(buf,A074684_actions,1,1),
+}
+
+
+def step_kernel(*fns):
+  '''Return a bit-buffer function computing the composition of fns (outermost first).'''
+  names = ()
+  for f in fns: names += composite_steps.get(f.__name__,(f.__name__,))
+
+  if names in fused_steps: return(fused_steps[names])
+  if use_subtree_memo: names = tuple([('tb_A057163_memo' if 'tb_A057163' == name else name) for name in names])
+
+  def bb_int_step(f): return(lambda buf: int_to_bitbuf(f(bitbuf_to_int(buf))))
+  stages = []
+  for name in names:
+     if name in bitbuf_steps: stages.insert(0,bitbuf_steps[name])
+     else: stages.insert(0,bb_int_step(globals()[name]))
+
+  def composed(buf):
+     for stage in stages: buf = stage(buf)
+     return(buf)
+  return(composed)
+
+
+def step_map(*fns):
+  '''Return a function computing the composition of fns (outermost first) on integers,
+     using a fused kernel from fused_steps if there is one for it.'''
+  kernel = step_kernel(*fns)
+  return(lambda a: bitbuf_to_int(kernel(int_to_bitbuf(a))))
+
+
+def bench_step_kernels(upto_n):
+  '''For each step map used by the generators, time upto_n iterations
+     with the plain composition and with step_map, and print the speed-up.'''
+  from time import time
+
+  cases = [('A080069', 2,  (tb_A057163,A079946,tb_A057164)),
+           ('A122232', 42, (A079946,tb_A057117)),
+           ('A122242', 42, (A079946,tb_A082358)),
+           ('A1new1',  42, (A079946,tb_Anewgm1)),
+           ('A0newX',  2,  (A079946,tb_A082360))]
+
+  for (name,seed,fns) in cases:
+    def plain(a):
+      for f in fns[::-1]: a = f(a)
+      return(a)
+    fused = step_map(*fns)
+
+    results = []
+    times = []
+    for step in (plain,fused):
+      i = seed
+      t = time()
+      for n in range(upto_n): i = step(i)
+      times.append(time()-t)
+      results.append(i)
+
+    print (name + ': plain ' + str(times[0]) + ' s, fused ' + str(times[1]) + ' s, speed-up '
+           + str(times[0]/max(times[1],1e-9)) + ', same result: ' + str(results[0] == results[1]))
 
-     size_stack.append(1+leftsize+rightsize)
-     tree_stack.append((1 << (leftsize+rightsize)) + (leftchild << rightsize) + rightchild)
 
-     a >>= 2 # Next digit in base-4.
+########################################################################
 
-  return(tree_stack.pop() >> 1) # Discard the last leaf by halving.
+# Ranking and unranking of totally balanced binary strings, A014486,
+# in the same order as there: first by size (the number of 1's),
+# and then by magnitude, which for strings of the same length is the
+# lexicographic order. ballot_table[r][h] is the number of ways to
+# complete a string with r more bits when h more 0's than 1's are needed,
+# i.e. the number of paths from height h down to 0 in r steps,
+# never going below 0. It is extended lazily, as needed.
+
+ballot_table = [[1]]
+
+def ballot(r,h):
+  '''Number of ways to finish a totally balanced binary string with r bits at height h.'''
+  if h < 0 or h > r: return(0)
+  while len(ballot_table) <= r:
+    m = len(ballot_table)
+    prev = ballot_table[-1]
+    row = [0]*(m+1)
+    for k in range(m+1):
+      if k+1 < m: row[k] += prev[k+1]
+      if k > 0: row[k] += prev[k-1]
+    ballot_table.append(row)
+  return(ballot_table[r][h])
+
+def A000108(n):
+  '''Catalan numbers, the number of totally balanced binary strings of size n.'''
+  return(ballot(2*n,0))
+
+def A014137(n):
+  '''Partial sums of Catalan numbers, i.e. the number of A014486-codes of size at most n.'''
+  return(sum([A000108(k) for k in range(n+1)]))
+
+
+def A080300(a):
+  '''Position of a in A014486, or 0 if a is not a totally balanced binary string.'''
+  if 0 == a: return(a)
+  s = bin(a)[2:]
+  r = len(s)
+  if r & 1: return(0)
+  rank = A014137((r//2)-1)
+  ballot(r,0) # Make sure the table is long enough.
+  h = 0
+  for c in s:
+    r -= 1
+    if '1' == c:
+      if h > 0: rank += ballot_table[r][h-1] # Skip all those with a 0 here.
+      h += 1
+      if h > r: return(0)
+    else:
+      h -= 1
+      if h < 0: return(0)
+  if 0 != h: return(0)
+  return(rank)
+
+
+def A014486(n):
+  '''The n:th totally balanced binary string, with A014486(0)=0.'''
+  size = 0
+  while n >= A000108(size):
+    n -= A000108(size)
+    size += 1
+  return(unrank_A014486(size,n))
+
+def unrank_A014486(size,n):
+  '''The n:th (from 0) totally balanced binary string with size 1's.'''
+  if 0 == size: return(0)
+  ballot(2*size,0) # Make sure the table is long enough.
+  a = 0
+  h = 0
+  for r in range((2*size)-1,-1,-1):
+    if h > 0: zeros = ballot_table[r][h-1]
+    else:     zeros = 0
+    a <<= 1
+    if n >= zeros:
+      a |= 1
+      n -= zeros
+      h += 1
+    else:
+      h -= 1
+  return(a)
 
 
+def genA014486(max_size=None):
+  '''Yield successive terms of A014486, 0, 2, 10, 12, 42, ..., all of them, or those of size at most max_size.'''
+  size = 0
+  while max_size is None or size <= max_size:
+    for n in xrange(A000108(size)): yield unrank_A014486(size,n)
+    size += 1
 
-def tb_A082358(a):
-  '''Implement the gatomorphism A082358 on A014486-codes. A variant of above.'''
-  return(tb_A057163(tb_A082356(a)))
 
-def tb_A082360(a):
-  '''Implement the gatomorphism A082360 on A014486-codes. A variant of above ones.'''
-  return(tb_A057163(tb_A074684(a)))
+def signature_permutation(tb_fn,max_size):
+  '''Return the signature permutation of the Catalan bijection tb_fn (working on A014486-codes)
+     as a list of A014137(max_size) terms: a(n) = A080300(tb_fn(A014486(n))).'''
+  return([A080300(tb_fn(a)) for a in genA014486(max_size)])
 
 
-# (same-intfuns? A082358 (compose-funs A057163 A057117) 2055) --> 56
-# I.e., are up to n=55 identical. Let's use that fact...
+########################################################################
+#
+# Batch versions of the gatomorphisms, for NumPy arrays of A014486-codes
+# of size at most 31 (batch_max_size), e.g. whole size classes. Although
+# the codes of size 32 still fit into 64 bits, the kernels keep subtrees
+# with their last leaf, i.e. of up to 2*size+1 bits, which would not.
+#
+# Instead of one Python call per code, each function below loops over
+# the bit positions (or nodes, or base-4 digits) of the codes, doing the
+# same step for all codes of the array at once. The codes are first grouped
+# by size (see batch_by_size), so that in each group every code has its
+# k:th bit, node or digit at the same place. Where the Python versions
+# keep a stack of subtrees, here the stacks are rows of a 2D array,
+# one row per code, accessed with flat indices and per-row stack pointers,
+# and each subtree is kept as its full preorder code (with the last leaf)
+# together with its length, joined as in tb_A057163.
+# The exception is batch_A125974, which is defined for any n, and so
+# steps all of them together, whatever their size.
+#
+# Needs NumPy, e.g.: pip install numpy
+#
+########################################################################
 
-def tb_Anewgm1(a):
-  '''Implement a new Cat. bijection on A014486-codes.'''
-  return(tb_A057163(tb_A057117(a)))
+batch_chunk_size = 1 << 20 # Codes processed at once, to bound the memory used.
+batch_max_size = 31
+
+
+def batch_check_size(size):
+  if size > batch_max_size:
+    raise ValueError("Codes of size " + str(size) + " do not fit in the batch kernels (at most " + str(batch_max_size) + ")")
+
+
+def batch_bit_length(codes):
+  '''A000523(n)+1 for each n in a uint64 array.'''
+  powers = numpy.array([1 << k for k in range(64)],dtype=numpy.uint64)
+  return(numpy.searchsorted(powers,codes,side='right'))
+
+
+def batch_by_size(codes,kernel):
+  '''Apply kernel(codes,size) to the codes of each size separately,
+     at most batch_chunk_size codes at a time, and return the results
+     in the same order as codes. Zero is always mapped to zero.'''
+  codes = numpy.asarray(codes,dtype=numpy.uint64)
+  out = numpy.zeros(codes.shape,dtype=numpy.uint64)
+  sizes = batch_bit_length(codes) // 2
+  if len(sizes): batch_check_size(int(sizes.max()))
+  for size in numpy.unique(sizes):
+    if 0 == size: continue
+    where = numpy.nonzero(sizes == size)[0]
+    for i in range(0,len(where),batch_chunk_size):
+      w = where[i:i+batch_chunk_size]
+      out[w] = kernel(codes[w],int(size))
+  return(out)
+
+
+def batch_lowbit_exponent(x):
+  '''A007814 for each nonzero n in a uint64 array, as uint64.'''
+  low = x & (~x + numpy.uint64(1))
+  return(numpy.log2(low.astype(numpy.float64)).astype(numpy.uint64)) # Exact for powers of 2.
+
+
+def batch_join(lf,ll,rf,rl):
+  '''Join subtrees (full preorder codes lf and rf, of lengths ll and rl) as the left and right child of a new node.'''
+  one = numpy.uint64(1)
+  return(((one << (ll+rl)) | (lf << rl) | rf, ll+rl+one))
+
+
+def batch_A057163_kernel(codes,size):
+  '''tb_A057163 for codes of the given size. The preorder of the reflected tree is
+     the reverse of the postorder of the original one, so the postorder is
+     written from the least significant end. As in reflected_postorder, for
+     each pending internal node we keep a flag telling whether its left subtree
+     is done, here as the bits of one uint64 per code, the top of the stack
+     at the least significant bit. A leaf completes the nodes whose flags are
+     1 at the top of the stack, which is found by adding 1 to the stack.'''
+  one = numpy.uint64(1)
+  stack = numpy.zeros(codes.shape,dtype=numpy.uint64)
+  out = numpy.zeros(codes.shape,dtype=numpy.uint64)
+  pos = numpy.zeros(codes.shape,dtype=numpy.uint64) # Where the next node of the postorder goes.
+  last = numpy.zeros(codes.shape,dtype=bool)
+  for i in range(2*size+1): # The last one is the implicit last leaf.
+    if i < 2*size: internal = ((codes >> numpy.uint64(2*size-1-i)) & one).astype(bool)
+    else:          internal = last
+    incr = stack + one
+    done = incr & ~stack # 2^k, where k is the number of internal nodes completed by a leaf.
+    k = numpy.log2(done.astype(numpy.float64)).astype(numpy.uint64)
+    out = numpy.where(internal,out,out | ((done - one) << (pos + one)))
+    pos = numpy.where(internal,pos,pos+k+one)
+    stack = numpy.where(internal,stack << one,incr >> k)
+  return(out >> one)
+
+
+def batch_A057117_kernel(codes,size):
+  '''tb_A057117 for codes of the given size. As in bb_A057117, the code is read
+     breadth-first: the children of the k:th 1-bit are at the positions 2k+1 and
+     2k+2 from the most significant end, which are the same for all the codes,
+     and their node numbers are the ranks of those bits. The children have
+     always larger numbers than their parents, so the subtrees can be joined
+     from the last node to the first one, the root.'''
+  m = len(codes)
+  n2 = 2*size
+  one = numpy.uint64(1)
+  bits = numpy.zeros((m,n2+2),dtype=numpy.int8) # Positions past the end are leaves.
+  for i in range(n2): bits[:,i] = (codes >> numpy.uint64(n2-1-i)) & one
+  rank = numpy.cumsum(bits,axis=1,dtype=numpy.int8) - bits
+
+# Row j of trees/lens is node j of code j//(size+1), the last node of each row being a leaf:
+  trees = numpy.zeros(m*(size+1),dtype=numpy.uint64)
+  lens = numpy.ones(m*(size+1),dtype=numpy.uint64)
+  base = numpy.arange(m,dtype=numpy.int64)*(size+1)
+  for k in range(size-1,-1,-1):
+    (l,r) = [base + numpy.where(bits[:,c],rank[:,c],numpy.int8(size)) for c in (2*k+1,2*k+2)]
+    (trees[base+k],lens[base+k]) = batch_join(trees[l],lens[l],trees[r],lens[r])
+  return(trees[base] >> one) # Node 0 is the root.
+
+
+def batch_quaternary_kernel(codes,size,actions):
+  '''quaternary_stack_machine for codes of the given size, with a stack of subtrees for
+     each code. All codes of size n have n-1 base-4 digits to process (the most
+     significant digit is 01), the k:th one being bits 2k-1 and 2k of the code.'''
+  m = len(codes)
+  one = numpy.uint64(1)
+  popleft = numpy.array([a[0] for a in actions],dtype=numpy.int64)
+  popright = numpy.array([a[1] for a in actions],dtype=numpy.int64)
+
+  trees = numpy.zeros(m*(size+1),dtype=numpy.uint64)
+  lens = numpy.zeros(m*(size+1),dtype=numpy.uint64)
+  base = numpy.arange(m,dtype=numpy.int64)*(size+1)
+  trees[base] = 4 # The implicit last node 100.
+  lens[base] = 3
+  sp = base + 1
+  leaf = numpy.zeros(m,dtype=numpy.uint64)
+  leaflen = numpy.ones(m,dtype=numpy.uint64)
+
+  for k in range(1,size):
+    digit = ((codes >> numpy.uint64(2*k-1)) & numpy.uint64(3)).astype(numpy.int64)
+    subtrees = []
+    for pops in (popleft[digit],popright[digit]):
+      sp -= pops
+      popped = pops.astype(bool)
+      subtrees.append((numpy.where(popped,trees[sp],leaf),numpy.where(popped,lens[sp],leaflen)))
+    ((lf,ll),(rf,rl)) = subtrees
+    (trees[sp],lens[sp]) = batch_join(lf,ll,rf,rl)
+    sp += 1
+
+  return(trees[base] >> one)
+
+
+def batch_A125974_kernel(codes):
+  '''A125974 for each n in a uint64 array, the loop of A125974_loop done for all of them in parallel.
+     Raises ValueError if some result does not fit in 64 bits.'''
+  one = numpy.uint64(1)
+  three = numpy.uint64(3)
+  chosen = codes >> batch_lowbit_exponent(numpy.where(codes == 0,one,codes)) # A000265, with 0 kept 0.
+  others = codes >> batch_lowbit_exponent(codes+one)
+  s = numpy.zeros(codes.shape,dtype=numpy.uint64)
+  b = codes & one
+  p = numpy.uint64(0)
+  active = (chosen != 0) | (others != 0)
+  while active.any():
+    last = (chosen == one) | (((chosen+one) & (chosen+one+one)) == 0)
+    low2 = chosen & three
+    cont = ~last & ((low2 == 0) | (low2 == three))
+    tozeros = ~last & (low2 == one)
+    toones = ~last & (low2 == three-one)
+
+    newchosen = numpy.where(last,others,chosen)
+    newchosen = numpy.where(cont,others,newchosen)
+    newchosen = numpy.where(tozeros,(chosen-one) >> batch_lowbit_exponent(numpy.where(tozeros,chosen-one,one)),newchosen)
+    newchosen = numpy.where(toones,chosen >> batch_lowbit_exponent(chosen+one+one),newchosen)
+    others = numpy.where(last,0,numpy.where(cont,chosen >> one,others))
+    chosen = newchosen
+
+    if p >= 64:
+      if (active & (b == one)).any(): raise ValueError("A125974 of some n does not fit in 64 bits")
+    else: s |= numpy.where(active,b << p,0)
+    b = numpy.where(last|cont,one-b,b)
+    p += one
+    active = (chosen != 0) | (others != 0)
+  return(s)
+
+
+def batch_A057163(codes):
+  '''tb_A057163 applied to each code in a NumPy array.'''
+  return(batch_by_size(codes,batch_A057163_kernel))
+
+def batch_A057117(codes):
+  '''tb_A057117 applied to each code in a NumPy array.'''
+  return(batch_by_size(codes,batch_A057117_kernel))
+
+def batch_A082356(codes):
+  '''tb_A082356 applied to each code in a NumPy array.'''
+  return(batch_by_size(codes,lambda c,size: batch_quaternary_kernel(c,size,A082356_actions)))
+
+def batch_A074684(codes):
+  '''tb_A074684 applied to each code in a NumPy array.'''
+  return(batch_by_size(codes,lambda c,size: batch_quaternary_kernel(c,size,A074684_actions)))
+
+def batch_A125974(codes):
+  '''A125974 applied to each n in a NumPy array, not only to A014486-codes,
+     so this is not grouped by size, and n may have all 64 bits.'''
+  codes = numpy.asarray(codes,dtype=numpy.uint64)
+  out = numpy.zeros(codes.shape,dtype=numpy.uint64)
+  for i in range(0,len(codes),batch_chunk_size):
+    out[i:i+batch_chunk_size] = batch_A125974_kernel(codes[i:i+batch_chunk_size])
+  return(out)
+
+
+def batch_ballot_table(size):
+  '''ballot(r,h) for r, h <= 2*size as a NumPy array, with an extra column of zeros for h = -1.'''
+  tab = numpy.zeros((2*size+1,2*size+2),dtype=numpy.int64)
+  for r in range(2*size+1):
+    for h in range(r+1): tab[r,h] = ballot(r,h)
+  return(tab)
+
+
+def batch_A080300_kernel(codes,size):
+  '''A080300 for totally balanced codes of the given size, ranked as in A080300.'''
+  tab = batch_ballot_table(size)
+  rank = numpy.zeros(codes.shape,dtype=numpy.int64) + A014137(size-1)
+  h = numpy.zeros(codes.shape,dtype=numpy.int64)
+  for r in range(2*size-1,-1,-1):
+    bit = ((codes >> numpy.uint64(r)) & numpy.uint64(1)).astype(numpy.int64)
+    rank += bit * tab[r][h-1] # h-1 = -1 picks the zero column.
+    h += 2*bit - 1
+  return(rank.astype(numpy.uint64))
+
+def batch_A080300(codes):
+  '''A080300 applied to each A014486-code in a NumPy array.'''
+  return(batch_by_size(codes,batch_A080300_kernel))
+
+
+def batch_unrank_A014486(size,ranks):
+  '''unrank_A014486(size,n) for each n in a NumPy array, giving a uint64 array.'''
+  batch_check_size(size)
+  tab = batch_ballot_table(size)
+  n = numpy.array(ranks,dtype=numpy.int64)
+  h = numpy.zeros(n.shape,dtype=numpy.int64)
+  a = numpy.zeros(n.shape,dtype=numpy.uint64)
+  for r in range(2*size-1,-1,-1):
+    zeros = tab[r][h-1]
+    bit = (n >= zeros)
+    n -= bit * zeros
+    h += 2*bit - 1
+    a = (a << numpy.uint64(1)) | bit.astype(numpy.uint64)
+  return(a)
+
+
+def batch_signature_permutation(batch_fn,max_size):
+  '''Same as signature_permutation(tb_fn,max_size), as a NumPy array, where batch_fn is
+     one of the batch functions above, e.g. batch_signature_permutation(batch_A057117,15).'''
+  batch_check_size(max_size)
+  out = numpy.zeros(A014137(max_size),dtype=numpy.uint64)
+  for size in range(1,max_size+1):
+    first = A014137(size-1)
+    for i in range(0,A000108(size),batch_chunk_size):
+      ranks = numpy.arange(i,min(i+batch_chunk_size,A000108(size)),dtype=numpy.int64)
+      out[first+i:first+i+len(ranks)] = batch_A080300(batch_fn(batch_unrank_A014486(size,ranks)))
+  return(out)
 
 
 ########################################################################
+#
+# Signature permutations of whole size classes on a process pool,
+# and their cycle structure.
+#
+# A size class of A014486-codes is split into ranges of ranks, each
+# worker unranks its codes, applies a tb_* function (given by name, so
+# that it can be sent to the worker) and ranks the results, and the
+# ranges are written in order to a file of native 32-bit integers,
+# where the i:th integer is the image of the i:th code of that size,
+# both counted from the first code of the size. The cycles are then
+# found with a bitmap of visited positions, one bit per code.
+#
+########################################################################
+
+from array import array
+
+def signature_permutation_range(job):
+  '''Worker for parallel_signature_permutation. job is (fname,size,start,stop).'''
+  (fname,size,start,stop) = job
+  tb_fn = globals()[fname]
+  first = A014137(size-1)
+  return(array('i',[A080300(tb_fn(unrank_A014486(size,i)))-first for i in xrange(start,stop)]))
+
+
+def parallel_signature_permutation(fname,size,filename=None,processes=None,chunk=1<<16):
+  '''Compute the signature permutation of the Catalan bijection named fname (e.g. 'tb_A057117')
+     restricted to the codes of the given size, with a multiprocessing pool of the given number
+     of processes (by default, one per core), writing it to filename (by default
+     fname_size.i32) as an array of 32-bit integers. Returns the filename.'''
+  from multiprocessing import Pool
+
+  if filename is None: filename = fname + "_" + str(size) + ".i32"
+  total = A000108(size)
+  jobs = [(fname,size,i,min(i+chunk,total)) for i in xrange(0,total,chunk)]
+
+  outfp = open(filename,'wb')
+  pool = Pool(processes)
+  try:
+    for part in pool.imap(signature_permutation_range,jobs): part.tofile(outfp)
+  finally:
+    pool.terminate()
+    outfp.close()
+  return(filename)
+
+
+def read_permutation(filename):
+  '''Read a permutation written by parallel_signature_permutation to an array of ints.'''
+  import os
+  perm = array('i')
+  infp = open(filename,'rb')
+  perm.fromfile(infp,os.path.getsize(filename) // perm.itemsize)
+  infp.close()
+  return(perm)
+
+
+def permutation_cycles(perm):
+  '''Return a dictionary giving for each cycle length of permutation perm (of 0..len(perm)-1)
+     the number of cycles of that length. Thus the number of fixed points is the value for 1.'''
+  n = len(perm)
+  visited = bytearray((n+7) // 8)
+  counts = {}
+  for i in xrange(n):
+    if visited[i >> 3] & (1 << (i & 7)): continue
+    length = 0
+    j = i
+    while not (visited[j >> 3] & (1 << (j & 7))):
+      visited[j >> 3] |= (1 << (j & 7))
+      j = perm[j]
+      length += 1
+    counts[length] = counts.get(length,0) + 1
+  return(counts)
+
+
+def orbit_summary(fname,size,processes=None):
+  '''Compute (in parallel) the signature permutation of fname on the codes of the given size,
+     and print the number of cycles, fixed points, the maximum cycle length and the
+     order of the permutation (LCM of the cycle lengths). Returns the cycle counts.'''
+  from fractions import gcd
+
+  counts = permutation_cycles(read_permutation(parallel_signature_permutation(fname,size,processes=processes)))
+  order = 1
+  for length in counts.keys(): order = (order*length) // gcd(order,length)
+  print (fname + ", size " + str(size) + ": " + str(A000108(size)) + " codes, "
+         + str(sum(counts.values())) + " cycles, " + str(counts.get(1,0)) + " fixed points, "
+         + "max cycle length " + str(max(counts.keys())) + ", order " + str(order))
+  return(counts)
+
 
 # For testing:
 
-seqA014486 = [0,2,10,12,42,44,50,52,56,170,172,178,180,184,202,
-              204,210,212,216,226,228,232,240,682,684,690,692,
-              696,714,716,722,724,728,738,740,744,752,810,812,
-              818,820,824,842,844,850,852,856,866,868,872,880,
-              906,908,914,916,920,930,932,936,944,962,964,968,976,992]
+seqA014486 = list(genA014486(5)) # [0,2,10,12,42,44,50,52,56,170,172,...,976,992]
 
 # For example:
-# l = [tb_A057117(n) for n in seqA014486]
-# [seqA014486.index(l[i]) for i in range(len(l))]
+# signature_permutation(tb_A057117,5)
 # Gives the signature-permutation of A057117:
 # [0, 1, 2, 3, 4, 5, 7, 8, 6, 9, 10, 12, 13, 11, 17, 18, 21, 22, 20, 14, 15, 16, 19, 23, 24, 26, 27, 25, 31, 32, 35, 36, 34, 28, 29, 30, 33, 45, 46, 49, 50, 48, 58, 59, 63, 64, 62, 54, 55, 57, 61, 37, 38, 40, 41, 39, 44, 47, 42, 43, 56, 60, 51, 52, 53]
 
-# l = [tb_A082356(n) for n in seqA014486]
-# [seqA014486.index(l[i]) for i in range(len(l))]
-
-# l = [tb_A082358(n) for n in seqA014486]
-# [seqA014486.index(l[i]) for i in range(len(l))]
-
-# l = [tb_A082360(n) for n in seqA014486]
-# [seqA014486.index(l[i]) for i in range(len(l))]
-
-# l = [tb_A074684(n) for n in seqA014486]
-# [seqA014486.index(l[i]) for i in range(len(l))]
+# Similarly signature_permutation(tb_A082356,5), signature_permutation(tb_A082358,5),
+# signature_permutation(tb_A082360,5) and signature_permutation(tb_A074684,5).
 
 ########################################################################
 
 
-def gen_from_bfile(filename):
-  '''Yield successive terms from b-file "filename".'''
+def gen_from_bfile(filename,cache=True):
+  '''Yield successive terms from b-file "filename", and then -1.
+     Returns the generator function, which reads the file anew on each call.
+     With cache=False no index file is read or written, e.g. for a temporary file.'''
   def bfilegenerator():
-      infp = open(filename,'r')
-    
-      linepat = re.compile(r'^([0-9]+) ([0-9]+)')
-    
-      terms = ""
-    
-      for line in infp.xreadlines(): 
-        m = linepat.match(line)
-        if(m):
-          ind  = m.group(1) #
-          val  = m.group(2) #
-          yield int(val);
-        else:
-          print "SKIPPING THE FOLLOWING LINE in " + filename + ": " + line + "\n"
-    
+      for n in gen_bfile_terms(open_bfile(filename,cache)): yield n
       yield(-1)
 
   return(bfilegenerator)
 
-# End of gen_from_bfile function.
+
+########################################################################
+#
+# Fast b-file writer.
+#
+# str() of a long integer takes time quadratic in its length, and with
+# rows of hundreds of thousands of bits it soon costs more than computing
+# and drawing them. int_to_decimal splits the number recursively by the
+# powers 10**(decimal_base_digits * 2**j), cached in decimal_powers with
+# their Barrett reciprocals, so that every division is done with two
+# multiplications, which CPython does with Karatsuba's method. Each
+# reciprocal is obtained with one Newton step from the square of the
+# previous one. Numbers shorter than decimal_above_bits go to str().
+# decimal_to_int does the opposite, joining the halves with the same powers.
+#
+# open_bfile_writer converts and writes the terms in a thread of its own,
+# in blocks of about bfile_block_size bytes. With companion 'hex' or 'bin'
+# (by default bfile_companion) the terms are also written in that radix to
+# a companion file, e.g. b080069.hex.txt, when decimal is not needed.
+# Note that the conversions hold the interpreter lock, so the thread
+# overlaps only the writing with the computing, not the conversions.
+#
+########################################################################
+
+decimal_base_digits = 1000
+decimal_above_bits = 1 << 15
+decimal_powers = [] # Tuples (10**(decimal_base_digits*2**j), its bit length b, 4**b // it).
+
+def decimal_power(j):
+  '''Return the j:th tuple of decimal_powers, computing it (and those before) if needed.'''
+  while len(decimal_powers) <= j:
+    if not decimal_powers:
+      p = 10**decimal_base_digits
+      b = p.bit_length()
+      decimal_powers.append((p,b,(1 << (2*b)) // p))
+      continue
+    (p0,b0,m0) = decimal_powers[-1]
+    p = p0*p0
+    b = p.bit_length()
+    k = 2*b
+    m = (m0*m0) >> (4*b0 - k) # Correct to about b0 bits,
+    m += (m*((1 << k) - p*m)) >> k # and after Newton's step to almost all of them.
+    r = (1 << k) - p*m
+    while r < 0:
+      m -= 1
+      r += p
+    while r >= p:
+      m += 1
+      r -= p
+    decimal_powers.append((p,b,m))
+  return(decimal_powers[j])
+
+
+def decimal_digits(n,j,out,pad):
+  '''Append the decimal digits of n < 10**(decimal_base_digits*2**(j+1)) to the list out,
+     padded with zeros to that length, if pad is true.'''
+  if j < 0:
+    if pad: out.append(str(n).zfill(decimal_base_digits))
+    else:   out.append(str(n))
+    return
+  (p,b,m) = decimal_power(j)
+  if not pad and n < p: return(decimal_digits(n,j-1,out,False))
+  q = ((n >> (b-1)) * m) >> (b+1) # Barrett's estimate, at most two too small.
+  r = n - q*p
+  while r >= p:
+    q += 1
+    r -= p
+  decimal_digits(q,j-1,out,pad)
+  decimal_digits(r,j-1,out,True)
+
+
+def int_to_decimal(n):
+  '''Same as str(n), but in subquadratic time.'''
+  if n < 0: return('-' + int_to_decimal(-n))
+  nbits = n.bit_length()
+  if nbits < decimal_above_bits: return(str(n))
+  j = 0
+  while nbits > 2*decimal_power(j)[1] - 2: j += 1 # Now n < decimal_power(j)[0]**2.
+  out = []
+  decimal_digits(n,j,out,False)
+  return(''.join(out))
+
+
+def decimal_to_int(s):
+  '''Same as int(s) for a string of decimal digits, but in subquadratic time.'''
+  if s.startswith('-'): return(-decimal_to_int(s[1:]))
+  if len(s) < decimal_above_bits // 3: return(int(s))
+  j = 0
+  while (decimal_base_digits << (j+1)) < len(s): j += 1
+  return(decimal_digits_to_int(s,j))
+
+
+def decimal_digits_to_int(s,j):
+  '''The value of the digits s, at most decimal_base_digits*2**(j+1) of them.'''
+  if j < 0: return(int(s))
+  d = decimal_base_digits << j
+  if len(s) <= d: return(decimal_digits_to_int(s,j-1))
+  return(decimal_digits_to_int(s[:-d],j-1)*decimal_power(j)[0] + decimal_digits_to_int(s[-d:],j-1))
+
+
+bfile_block_size = 1 << 20
+bfile_queue_size = 16
+bfile_companion = None
+
+companion_formats = { 'hex': (lambda n: '%x' % n), 'bin': (lambda n: format(n,'b')) }
+
+def companion_filename(filename,companion):
+  '''E.g. b080069.txt -> b080069.hex.txt'''
+  import os
+  (root,ext) = os.path.splitext(filename)
+  return(root + "." + companion + ext)
+
+
+def open_bfile_writer(filename,start=0,companion=None):
+  '''Start a thread writing the b-file filename, of the terms given to the returned
+     function write, indexed from start+1, and also to the companion file, if companion
+     ('hex' or 'bin') is given. Returns (write,close), where close waits until all
+     has been written, and raises IOError if the thread failed. Call close also when
+     stopping early, as the last block of lines is written only then.'''
+  import threading
+  from Queue import Queue
+  from traceback import format_exc
+
+  queue = Queue(bfile_queue_size)
+  errors = []
+
+  def writer():
+    failed = False
+    outs = []
+    try:
+      outs.append((open(filename,'w'),int_to_decimal))
+      if companion: outs.append((open(companion_filename(filename,companion),'w'),companion_formats[companion]))
+    except Exception:
+      errors.append(format_exc())
+      failed = True
+    blocks = [[] for out in outs]
+    sizes = [0 for out in outs]
+    row = start
+    while True:
+      n = queue.get()
+      if n is None: break
+      if failed: continue # Just empty the queue, so that write never blocks forever.
+      row += 1
+      try:
+        for i in range(len(outs)):
+          (fp,fmt) = outs[i]
+          line = str(row) + " " + fmt(n) + "\n"
+          blocks[i].append(line)
+          sizes[i] += len(line)
+          if sizes[i] >= bfile_block_size:
+            fp.write(''.join(blocks[i]))
+            blocks[i] = []
+            sizes[i] = 0
+      except Exception:
+        errors.append(format_exc())
+        failed = True
+    for i in range(len(outs)): # Even after a failure, keep what was got so far.
+      try:
+        outs[i][0].write(''.join(blocks[i]))
+        outs[i][0].close()
+      except Exception:
+        errors.append(format_exc())
+
+  thread = threading.Thread(target=writer)
+  thread.daemon = True
+  thread.start()
+
+  def close():
+    queue.put(None)
+    thread.join()
+    if errors: raise IOError("Writing " + filename + " failed:\n" + errors[0])
+
+  return((queue.put,close))
+
+
+########################################################################
+#
+# Packed binary row store.
+#
+# An alternative to b-files for long rows: the rows are stored as raw
+# big-endian bytes one after another in the file r<filebase>.bin, and
+# the file r<filebase>.idx contains for each row the offset where it
+# ends, as an 8-byte little-endian integer. Writing and reading is
+# linear in the number of bits (no decimal conversions), and with
+# both files memory-mapped, any row can be fetched directly.
+#
+########################################################################
+
+import struct
+
+def rowstore_filenames(filebase):
+  return(("r"+filebase+".bin","r"+filebase+".idx"))
+
+
+def int_to_bytes(n):
+  '''Big-endian bytes of a nonnegative integer, as a str, empty for zero.'''
+  if 0 == n: return('')
+  h = '%x' % n
+  if len(h) & 1: h = '0' + h
+  return(unhexlify(h))
+
+def bytes_to_int(b):
+  '''Inverse of int_to_bytes.'''
+  if 0 == len(b): return(0)
+  return(int(hexlify(b),16))
+
+
+def gen_storing_rows(gen,filebase,append=False):
+  '''Yield the terms of gen, also appending each one to the row store filebase
+     (which is started anew unless append is True), e.g.
+     draw_up_to_n(gen_storing_rows(genA122242(),"122242"),...)'''
+  (binname,idxname) = rowstore_filenames(filebase)
+  mode = 'ab' if append else 'wb'
+  binfp = open(binname,mode)
+  idxfp = open(idxname,mode)
+  binfp.seek(0,2)
+  offset = binfp.tell()
+  try:
+    for n in gen:
+      b = int_to_bytes(n)
+      binfp.write(b)
+      offset += len(b)
+      idxfp.write(struct.pack('<Q',offset))
+      yield n
+  finally:
+    binfp.close()
+    idxfp.close()
+
+
+def open_rowstore(filebase):
+  '''Open the row store filebase for reading, returning a handle for rowstore_count and rowstore_row.'''
+  import mmap
+  maps = []
+  for name in rowstore_filenames(filebase):
+    fp = open(name,'rb')
+    fp.seek(0,2)
+    if 0 == fp.tell(): maps.append('') # An empty file cannot be mapped.
+    else: maps.append(mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ))
+    fp.close()
+  return(tuple(maps))
+
+
+def rowstore_count(store):
+  '''Number of rows in the row store.'''
+  return(len(store[1]) // 8)
+
+
+def rowstore_row(store,i):
+  '''Row i (zero-based) of the row store, as an integer.'''
+  (data,index) = store
+  end = struct.unpack_from('<Q',index,8*i)[0]
+  if 0 == i: begin = 0
+  else: begin = struct.unpack_from('<Q',index,8*(i-1))[0]
+  return(bytes_to_int(data[begin:end]))
+
+
+def gen_from_rowstore(filebase,start=0):
+  '''Yield the rows of the row store filebase, starting from row start (zero-based).'''
+  store = open_rowstore(filebase)
+  for i in xrange(start,rowstore_count(store)): yield rowstore_row(store,i)
+
+
+def draw_from_rowstore(filebase,upto_n,scale,captext,maxwidth,start=0):
+  '''Redraw upto_n rows of the row store filebase, starting from row start, without rewriting the b-file.'''
+  draw_up_to_n(gen_from_rowstore(filebase,start),upto_n,scale,filebase,captext,maxwidth,start,bfile=False)
+
+
+def store_columns(rows,upto_n,filebases):
+  '''Write the first upto_n tuples yielded by rows, with one term for each of filebases,
+     to the row stores of filebases (started anew), so that the columns need not be
+     kept in memory. Returns the number of rows written.'''
+  from itertools import islice
+  files = [tuple([open(name,'wb') for name in rowstore_filenames(fb)]) for fb in filebases]
+  offsets = [0]*len(filebases)
+  n = 0
+  try:
+    for row in islice(rows,upto_n):
+      for i in range(len(files)):
+        b = int_to_bytes(row[i])
+        files[i][0].write(b)
+        offsets[i] += len(b)
+        files[i][1].write(struct.pack('<Q',offsets[i]))
+      n += 1
+  finally:
+    for (binfp,idxfp) in files:
+      binfp.close()
+      idxfp.close()
+  return(n)
+
+
+def draw_family(rows,upto_n,scale,mw,names):
+  '''Draw the sequences names (A-numbers) up to upto_n:th row, when rows yields tuples
+     of their terms, like gen_trajectory_family. The columns go first to the row stores,
+     which are left in place, and each sequence is then drawn from its row store.'''
+  filebases = [sequence_filebase(name) for name in names]
+  store_columns(rows,upto_n,filebases)
+  for (name,filebase) in zip(names,filebases):
+    draw_up_to_n(gen_from_rowstore(filebase),upto_n,scale,filebase,"See: http://oeis.org/"+name,mw)
+
+
+########################################################################
+#
+# Indexed b-file reader.
+#
+# open_bfile memory-maps the b-file, and finds where each term is in it
+# by scanning it once with str.find (no regular expressions). These
+# offsets are saved to an index file next to the b-file, e.g.
+# b218776.upto4096.idx, together with the size and modification time of
+# the b-file, so that opening the same unchanged b-file again just maps
+# the index as well. Then any term can be parsed directly from the map.
+# Empty lines and those starting with # are skipped, and the terms are
+# assumed to be indexed consecutively, as in the b-files of OEIS.
+# The companion files of open_bfile_writer are read in their own radix.
+# A line is counted as ill-formed unless its term consists only of the
+# digits of that radix, with an optional minus sign.
+#
+########################################################################
+
+bfile_index_header = struct.Struct('<8sQdqQ') # Magic, size and mtime of the b-file, first index, count.
+bfile_index_magic = 'bfileidx'
+companion_radices = { 'hex': 16, 'bin': 2 }
+radix_digits = { 10: '0123456789', 16: '0123456789abcdefABCDEF', 2: '01' }
+
+def bfile_index_filename(filename):
+  '''E.g. b218776.upto4096.txt -> b218776.upto4096.idx'''
+  import os
+  return(os.path.splitext(filename)[0] + ".idx")
+
+
+def map_file(filename):
+  '''Memory-map filename for reading. An empty file gives an empty string.'''
+  import mmap
+  fp = open(filename,'rb')
+  try:
+    fp.seek(0,2)
+    if 0 == fp.tell(): return('')
+    return(mmap.mmap(fp.fileno(),0,access=mmap.ACCESS_READ))
+  finally:
+    fp.close()
+
+
+def scan_bfile(data,radix=10):
+  '''Return the first index, the list of start and end offsets of the terms
+     and the number of ill-formed lines in the b-file contents data.'''
+  digits = radix_digits[radix]
+  first = None
+  spans = []
+  bad = 0
+  pos = 0
+  size = len(data)
+  while pos < size:
+    nl = data.find('\n',pos)
+    if nl < 0: nl = size
+    head = data[pos:min(nl,pos+64)] # Long enough for the index and the start of the term.
+    fields = head.split(None,1)
+    if fields and not fields[0].startswith('#'):
+      i = head.index(fields[0]) + len(fields[0])
+      while i < len(head) and head[i] in ' \t': i += 1
+      begin = pos + i
+      end = nl
+      while end > begin and data[end-1] in ' \t\r': end -= 1
+      term = data[begin+('-' == data[begin:begin+1]):end]
+      if len(fields) < 2 or not fields[0].isdigit() or not term or term.translate(None,digits):
+        bad += 1
+      else:
+        if first is None: first = int(fields[0])
+        spans.append(begin)
+        spans.append(end)
+    pos = nl+1
+  if first is None: first = 0
+  return((first,spans,bad))
+
+
+def open_bfile(filename,cache=True):
+  '''Open the b-file filename, indexing it unless its index is already cached,
+     returning a handle for bfile_count, bfile_first_index, bfile_term and gen_bfile_terms.
+     With cache=False the index is neither looked up nor saved.'''
+  import os
+  info = os.stat(filename)
+  data = map_file(filename)
+  radix = companion_radices.get(os.path.splitext(os.path.splitext(filename)[0])[1][1:],10)
+  idxname = bfile_index_filename(filename)
+
+  try:
+    if not cache: raise IOError("not cached")
+    index = map_file(idxname)
+    (magic,size,mtime,first,count) = bfile_index_header.unpack_from(index,0)
+    if (magic != bfile_index_magic or size != info.st_size or mtime != info.st_mtime
+        or len(index) != bfile_index_header.size + 16*count): index = None
+  except (IOError, struct.error):
+    index = None
+
+  if index is None:
+    (first,spans,bad) = scan_bfile(data,radix)
+    if bad: print 'Skipped ' + str(bad) + ' ill-formed lines in ' + filename
+    count = len(spans) // 2
+    index = (bfile_index_header.pack(bfile_index_magic,info.st_size,info.st_mtime,first,count)
+             + struct.pack('<' + str(len(spans)) + 'Q',*spans))
+    try:
+      if not cache: raise IOError("not cached")
+      tmpname = idxname + ".tmp"
+      fp = open(tmpname,'wb')
+      fp.write(index)
+      fp.close()
+      os.rename(tmpname,idxname)
+    except (IOError, OSError): # E.g. a read-only directory. Then just keep it in memory.
+      pass
+
+  return((data,index,first,count,radix))
+
+
+def index_bfile_in_background(filename):
+  '''Start indexing the b-file filename (if not cached already) in a thread, e.g. while
+     something else is computed. Returns the thread.'''
+  import threading
+  thread = threading.Thread(target=open_bfile,args=(filename,))
+  thread.daemon = True
+  thread.start()
+  return(thread)
+
+
+def bfile_count(bf):
+  '''Number of terms in the b-file.'''
+  return(bf[3])
+
+
+def bfile_first_index(bf):
+  '''Index of the first term of the b-file, usually 0 or 1.'''
+  return(bf[2])
+
+
+def bfile_term(bf,i):
+  '''Term i (zero-based, i.e. the one with index bfile_first_index(bf)+i) of the b-file.'''
+  (data,index,first,count,radix) = bf
+  if i < 0 or i >= count: raise IndexError("b-file has only " + str(count) + " terms")
+  (begin,end) = struct.unpack_from('<QQ',index,bfile_index_header.size+16*i)
+  if 10 == radix: return(decimal_to_int(data[begin:end]))
+  return(int(data[begin:end],radix))
+
+
+def gen_bfile_terms(bf,start=0,stop=None):
+  '''Yield the terms start, start+1, ..., up to stop (or all), zero-based, of the b-file.'''
+  if stop is None or stop > bfile_count(bf): stop = bfile_count(bf)
+  for i in xrange(start,stop): yield bfile_term(bf,i)
 
 
 def take(n,g):
@@ -475,78 +1924,87 @@ def take(n,g):
 
 def genA080069():
     '''Yield successive terms of A080069, starting from A080069(1)=2.'''
+    step = step_map(tb_A057163,A079946,tb_A057164)
     i = 2
     while True:
        yield i
-       i = tb_A057163(A079946(tb_A057164(i)))
+       i = step(i)
 
 def genA080070():
     '''Yield successive terms of A080070, starting from A080070(1)=10.'''
+    step = step_map(tb_A057163,A079946,tb_A057164)
     i = 2
     while True:
-       yield A007088(i)
-       i = tb_A057163(A079946(tb_A057164(i)))
+       yield int(bin(i)[2:]) # I.e. A007088(i), without the recursion.
+       i = step(i)
 
 
 def genA122229():
     '''Yield successive terms of A122229, starting from A122229(1)=2.'''
+    step = step_map(A079946,tb_A057117)
     i = 2 # Boring to look at, but included for completeness!
     while True:
        yield i
-       i = A079946(tb_A057117(i))
+       i = step(i)
 
 
 def genA122232():
     '''Yield successive terms of A122232, starting from A122232(1)=42.'''
+    step = step_map(A079946,tb_A057117)
     i = 42 # Chaotic...
     while True:
        yield i
-       i = A079946(tb_A057117(i))
+       i = step(i)
 
 
 def genA122235():
     '''Yield successive terms of A122235, starting from A122235(1)=44.'''
+    step = step_map(A079946,tb_A057117)
     i = 44 # Similar looking. Should compute for starting values 50 and 52 also.
     while True:
        yield i
-       i = A079946(tb_A057117(i))
+       i = step(i)
 
 
 def genA122239():
     '''Yield successive terms of A122239, starting from A122239(1)=52.'''
+    step = step_map(A079946,tb_A057117)
     i = 52 # Similar looking. Should compute for starting value 50 also.
     while True:
        yield i
-       i = A079946(tb_A057117(i))
+       i = step(i)
 
 # Neither A082356 nor A074684 dissipate the change.
 # But A082358 is surely interesting!
 
 def genA122242():
     '''Yield successive terms of A122242, starting from A122242(1)=42.'''
+    step = step_map(A079946,tb_A082358)
     i = 42
     while True:
        yield i
-       i = A079946(tb_A082358(i))
+       i = step(i)
 
 
 def genA376402():
     '''Yield successive terms of A376402, 164, 628, 2444, 10040, 34424, 142400, ...: a(n) = A122242(1+n) XOR 2*A122242(n).'''
+    step = step_map(A079946,tb_A082358)
     s = 42
     while True:
-       t = A079946(tb_A082358(s))
+       t = step(s)
        yield (t^(s<<1))
        s = t
 
 
 def genA376412():
     '''Yield successive terms of A376412, 14544, 64920, 258096, 925720, 3703264, ...: a(n) = A122242(4+n) XOR 16*A122242(n).'''
+    step = step_map(A079946,tb_A082358)
     t0 = 42
-    t1 = A079946(tb_A082358(t0))
-    t2 = A079946(tb_A082358(t1))
-    t3 = A079946(tb_A082358(t2))
+    t1 = step(t0)
+    t2 = step(t1)
+    t3 = step(t2)
     while True:
-       t4 = A079946(tb_A082358(t3))
+       t4 = step(t3)
        yield (t4^(t0<<4))
        t0 = t1
        t1 = t2
@@ -557,29 +2015,32 @@ def genA376412():
        
 def genA122245():
     '''Yield successive terms of A122245, starting from A122245(1)=44.'''
+    step = step_map(A079946,tb_A082358)
     i = 44 # Similar looking to A122242. Should compute for starting values 50 and 52 also.
     while True:
        yield i
-       i = A079946(tb_A082358(i))
+       i = step(i)
 
 
 def genA376405():
     '''Yield successive terms of A376405, 176, 584, 2068, 9232, 38952, 135296, ...: a(n) = A122245(1+n) XOR 2*A122245(n).'''
+    step = step_map(A079946,tb_A082358)
     s = 44
     while True:
-       t = A079946(tb_A082358(s))
+       t = step(s)
        yield (t^(s<<1))
        s = t
 
 
 def genA376415():
     '''Yield successive terms of A376415, 14488, 57880, 258096, 1033752, 3702824, ...: a(n) = A122245(4+n) XOR 16*A122245(n).'''
+    step = step_map(A079946,tb_A082358)
     t0 = 44
-    t1 = A079946(tb_A082358(t0))
-    t2 = A079946(tb_A082358(t1))
-    t3 = A079946(tb_A082358(t2))
+    t1 = step(t0)
+    t2 = step(t1)
+    t3 = step(t2)
     while True:
-       t4 = A079946(tb_A082358(t3))
+       t4 = step(t3)
        yield (t4^(t0<<4))
        t0 = t1
        t1 = t2
@@ -589,17 +2050,19 @@ def genA376415():
        
 def genA179755():
     '''Yield successive terms of A179755, starting from A179755(1)=50.'''
+    step = step_map(A079946,tb_A082358)
     i = 50
     while True:
        yield i
-       i = A079946(tb_A082358(i))
+       i = step(i)
 
 def genA179757():
     '''Yield successive terms of A179757, starting from A179757(1)=56.'''
+    step = step_map(A079946,tb_A082358)
     i = 56
     while True:
        yield i
-       i = A079946(tb_A082358(i))
+       i = step(i)
 
 def genA179417():
     '''Yield successive terms of A179417, starting from A179417(0)=1.'''
@@ -608,14 +2071,23 @@ def genA179417():
        yield A179417(i)
        i += 1
 
+def gen_quadratic_residue_triangle(p):
+    '''Yield successive rows of the A179417-like triangle for the odd prime p, the n:th row being
+       the 2n+1 bits of the quadratic residue pattern mod p starting at 1+n^2.'''
+    i = 0
+    while True:
+       yield quadratic_residue_window(p,1+(i*i),1+(2*i))
+       i += 1
+
 
 # Regular, boring:
 def genA1new0():
     '''Yield successive terms of A1new0, starting from A1new0(1)=2.'''
+    step = step_map(A079946,tb_Anewgm1)
     i = 2
     while True:
        yield i
-       i = A079946(tb_Anewgm1(i))
+       i = step(i)
 
 
 # Very chaotic, although the first four terms in both iterations
@@ -623,76 +2095,84 @@ def genA1new0():
 
 def genA1new1():
     '''Yield successive terms of A1new1, starting from A1new1(1)=42.'''
+    step = step_map(A079946,tb_Anewgm1)
     i = 42
     while True:
        yield i
-       i = A079946(tb_Anewgm1(i))
+       i = step(i)
 
 def genA1new2():
     '''Yield successive terms of A1new2, starting from A1new2(1)=44.'''
+    step = step_map(A079946,tb_Anewgm1)
     i = 44
     while True:
        yield i
-       i = A079946(tb_Anewgm1(i))
+       i = step(i)
 
 
 def genA0new11():
     '''Yield successive terms of A0new11.'''
+    step = step_map(A079946,tb_A082358)
     i = 42
     j = 44
     while True:
        yield (i^j)
-       i = A079946(tb_A082358(i))
-       j = A079946(tb_A082358(j))
+       i = step(i)
+       j = step(j)
 
 
 def genA0new12():
     '''Yield successive terms of A0new12.'''
+    step = step_map(A079946,tb_A082358)
     i = 42
     j = 50
     while True:
        yield (i^j)
-       i = A079946(tb_A082358(i))
-       j = A079946(tb_A082358(j))
+       i = step(i)
+       j = step(j)
 
 
 def genA0new13():
     '''Yield successive terms of A0new13.'''
+    step = step_map(A079946,tb_A082358)
     i = 42
     j = 56
     while True:
        yield (i^j)
-       i = A079946(tb_A082358(i))
-       j = A079946(tb_A082358(j))
+       i = step(i)
+       j = step(j)
 
 
 def genA0new14():
     '''Yield successive terms of A0new14.'''
+    step = step_map(A079946,tb_A082358)
     i = 44
     j = 50
     while True:
        yield (i^j)
-       i = A079946(tb_A082358(i))
-       j = A079946(tb_A082358(j))
+       i = step(i)
+       j = step(j)
 
 
 def genA0new15():
     '''Yield successive terms of A0new15.'''
+    step = step_map(A079946,tb_A082358)
     i = 44
     j = 56
     while True:
        yield (i^j)
-       i = A079946(tb_A082358(i))
-       j = A079946(tb_A082358(j))
+       i = step(i)
+       j = step(j)
 
 def genA0new16():
     '''Yield successive terms of A0new16.'''
+    step = step_map(A079946,tb_A082358)
     i = 50
     j = 56
     while True:
        yield (i^j)
-       i = A079946(tb_A082358(i))
-       j = A079946(tb_A082358(j))
+       i = step(i)
+       j = step(j)
 
 
 
@@ -700,49 +2180,294 @@ def genA0new16():
 # Ah, Pyramids are here again! (Keep this!)
 def genA0new3():
     '''Yield successive terms of A0new3, starting from A0new3(1)=2.'''
+    step = step_map(A079946,A125974)
     i = 2
     while True:
        yield i
-       i = A079946(A125974(i))
+       i = step(i)
 
 # Keep this! Why the funny checker-board pattern when non-zoomed?
 # (it's an artefact of PNG-display routine, most probably!)
 def genA0new4():
     '''Yield successive terms of A0new4, starting from A0new4(1)=2.'''
+    step = step_map(A079946,tb_A057163,A125974,tb_A057163)
     i = 2
     while True:
        yield i
-       i = A079946(tb_A057163(A125974(tb_A057163(i))))
+       i = step(i)
 
 # Maybe this also.
 def genA0new5():
     '''Yield successive terms of A0new5, starting from A0new5(1)=2.'''
+    step = step_map(tb_A057163,A079946,A125974,tb_A057163)
     i = 2
     while True:
        yield i
-       i = tb_A057163(A079946(A125974(tb_A057163(i))))
+       i = step(i)
 
 # Something like 1D "gliders":
 def genA0new6():
     '''Yield successive terms of A0new6, starting from A0new6(1)=44.'''
+    step = step_map(A125974,A079946,tb_A057163)
     i = 44
     while True:
        yield i
-       i = A125974(A079946(tb_A057163(i)))
+       i = step(i)
 
 def genA0new7():
     '''Yield successive terms of A0new3, starting from A0new3(1)=2.'''
+    step = step_map(A079946,A125974)
     i = 44
     while True:
        yield i
-       i = A079946(A125974(i))
+       i = step(i)
 
 def genA0newX():
     '''Yield successive terms of A0new1, starting from A0newX(1)=2.'''
+    step = step_map(A079946,tb_A082360)
     i = 2 # Very regular, like some class-1 1D-CA.
     while True:
        yield i
-       i = A079946(tb_A082360(i))
+       i = step(i)
+
+
+########################################################################
+#
+# Checkpointing the above iterations.
+#
+# All the generators above iterate a fixed step map from fixed seeds,
+# so their whole state is one or a few integers. The table trajectories
+# gives for each such sequence the step map (as the functions given to
+# step_map), the seeds, and how the terms are formed from the state:
+#  'terms'       the current term of the trajectory itself,
+#  'binary'      the same, written in binary (A007088), as in genA080070,
+#  'xor'         the XOR of two trajectories, as in genA0new11,
+#  ('lagxor',k)  t(n+k) XOR (t(n) << k), as in genA376402 and genA376412.
+# gen_trajectory yields the same terms as the corresponding genA*, and
+# saves its state to a checkpoint file every so many rows, from which
+# a later run can continue, e.g. to extend an image with more rows.
+# gen_trajectory_family computes several of them at once, sharing the
+# orbits they have in common, like gen_ca_family for the 1D-CA sequences.
+#
+########################################################################
+
+trajectories = {
+  'A080069' : ((tb_A057163,A079946,tb_A057164), (2,), 'terms'),
+  'A080070' : ((tb_A057163,A079946,tb_A057164), (2,), 'binary'),
+  'A122229' : ((A079946,tb_A057117), (2,), 'terms'),
+  'A122232' : ((A079946,tb_A057117), (42,), 'terms'),
+  'A122235' : ((A079946,tb_A057117), (44,), 'terms'),
+  'A122239' : ((A079946,tb_A057117), (52,), 'terms'),
+  'A122242' : ((A079946,tb_A082358), (42,), 'terms'),
+  'A122245' : ((A079946,tb_A082358), (44,), 'terms'),
+  'A179755' : ((A079946,tb_A082358), (50,), 'terms'),
+  'A179757' : ((A079946,tb_A082358), (56,), 'terms'),
+  'A376402' : ((A079946,tb_A082358), (42,), ('lagxor',1)),
+  'A376405' : ((A079946,tb_A082358), (44,), ('lagxor',1)),
+  'A376412' : ((A079946,tb_A082358), (42,), ('lagxor',4)),
+  'A376415' : ((A079946,tb_A082358), (44,), ('lagxor',4)),
+  'A1new0'  : ((A079946,tb_Anewgm1), (2,), 'terms'),
+  'A1new1'  : ((A079946,tb_Anewgm1), (42,), 'terms'),
+  'A1new2'  : ((A079946,tb_Anewgm1), (44,), 'terms'),
+  'A0new11' : ((A079946,tb_A082358), (42,44), 'xor'),
+  'A0new12' : ((A079946,tb_A082358), (42,50), 'xor'),
+  'A0new13' : ((A079946,tb_A082358), (42,56), 'xor'),
+  'A0new14' : ((A079946,tb_A082358), (44,50), 'xor'),
+  'A0new15' : ((A079946,tb_A082358), (44,56), 'xor'),
+  'A0new16' : ((A079946,tb_A082358), (50,56), 'xor'),
+  'A0new3'  : ((A079946,A125974), (2,), 'terms'),
+  'A0new4'  : ((A079946,tb_A057163,A125974,tb_A057163), (2,), 'terms'),
+  'A0new5'  : ((tb_A057163,A079946,A125974,tb_A057163), (2,), 'terms'),
+  'A0new6'  : ((A125974,A079946,tb_A057163), (44,), 'terms'),
+  'A0new7'  : ((A079946,A125974), (44,), 'terms'),
+  'A0newX'  : ((A079946,tb_A082360), (2,), 'terms'),
+}
+
+# The file bases of the sequences without an A-number yet, as used by their do_it_for_* functions.
+# (There is no do_it_for_A0newX, so it is just named like the others.)
+unnumbered_filebases = {
+  'A1new0'  : '800000', 'A1new1'  : '800001', 'A1new2'  : '800002',
+  'A0new3'  : '900003', 'A0new4'  : '900004', 'A0new5'  : '900005', 'A0new6'  : '900006',
+  'A0new7'  : '900007', 'A0new11' : '900011', 'A0new12' : '900012', 'A0new13' : '900013',
+  'A0new14' : '900014', 'A0new15' : '900015', 'A0new16' : '900016', 'A0newX'  : '90000X',
+}
+
+def sequence_filebase(name):
+  '''The file base of the b-file and image of sequence name, e.g. 122242 for A122242.'''
+  return(unnumbered_filebases.get(name,name[1:]))
+
+
+def trajectory_start(name):
+  '''The state of trajectory name before its first term.'''
+  (fns,seeds,kind) = trajectories[name]
+  state = list(seeds)
+  if 'lagxor' == kind[0]:
+    step = step_map(*fns)
+    while len(state) <= kind[1]: state.append(step(state[-1]))
+  return(state)
+
+
+def trajectory_term(kind,state):
+  if 'terms' == kind:  return(state[0])
+  if 'binary' == kind: return(int(bin(state[0])[2:])) # I.e. A007088.
+  if 'xor' == kind:    return(state[0]^state[1])
+  return(state[kind[1]]^(state[0]<<kind[1])) # lagxor
+
+
+def checkpoint_filename(name):
+  return("c" + sequence_filebase(name) + ".txt")
+
+
+def save_checkpoint(filename,name,row,state):
+  '''Save the state of trajectory name after its row first terms, in hexadecimal, one integer per line.'''
+  import os
+  tmpname = filename + ".tmp"
+  outfp = open(tmpname,'w')
+  outfp.write(name + " " + str(row) + "\n")
+  for x in state: outfp.write(('%x' % x) + "\n")
+  outfp.close()
+  os.rename(tmpname,filename) # So that an interrupted save does not destroy the previous checkpoint.
+
+
+def load_checkpoint(filename,name):
+  '''Return (row,state) saved by save_checkpoint for trajectory name, or None if there is no such file.'''
+  try:
+    infp = open(filename,'r')
+  except IOError:
+    return(None)
+  lines = infp.read().split()
+  infp.close()
+  if (len(lines) < 3) or (lines[0] != name): return(None)
+  return((int(lines[1]),[int(x,16) for x in lines[2:]]))
+
+
+def gen_trajectory(name,row=0,state=None,every=0,filename=None,before_save=None):
+  '''Yield the terms of trajectory name, starting from the row:th term (zero-based) whose state
+     is given, or from the start. If every > 0, save the state to the checkpoint file filename
+     (by default checkpoint_filename(name)) each time a multiple of every terms have been
+     taken, and when the generator is closed (e.g. after the last row has been drawn).
+     before_save(row), if given, is called before each save, e.g. to flush the b-file
+     where the terms taken so far are written.'''
+  (fns,seeds,kind) = trajectories[name]
+  step = step_map(*fns)
+  if state is None: (row,state) = (0,trajectory_start(name))
+  if filename is None: filename = checkpoint_filename(name)
+  lagged = (kind[0] == 'lagxor')
+  first = row
+
+  def save():
+    if before_save: before_save(row)
+    save_checkpoint(filename,name,row,state)
+
+  try:
+    while True:
+      if (every > 0) and (row > first) and (0 == (row % every)): save()
+      yield trajectory_term(kind,state)
+      if lagged: state = state[1:] + [step(state[-1])]
+      else:      state = [step(x) for x in state]
+      row += 1
+  finally:
+    if (every > 0) and (row > first): save()
+
+
+def gen_trajectory_family(names):
+  '''Yield tuples containing the successive terms of the sequences named in names (keys of
+     trajectories), the n:th tuple containing the n:th term of each. Each distinct orbit,
+     keyed by (step functions, seed), is computed only once, and kept as a window of
+     as many terms as the longest lag needs, from which each term is then derived.'''
+  from collections import deque
+
+  specs = [trajectories[name] for name in names]
+  maxlag = max([0] + [kind[1] for (fns,seeds,kind) in specs if 'lagxor' == kind[0]])
+
+  orbits = {} # (fns,seed) -> index into windows.
+  windows = []
+  steps = []
+  for (fns,seeds,kind) in specs:
+    for seed in seeds:
+      if (fns,seed) in orbits: continue
+      orbits[(fns,seed)] = len(windows)
+      step = step_map(*fns)
+      w = deque([seed])
+      while len(w) <= maxlag: w.append(step(w[-1]))
+      windows.append(w)
+      steps.append(step)
+
+  uses = [(kind,[orbits[(fns,seed)] for seed in seeds]) for (fns,seeds,kind) in specs]
+  while True:
+    terms = []
+    for (kind,ws) in uses:
+      if 'lagxor' == kind[0]: state = list(windows[ws[0]])[:kind[1]+1]
+      else:                   state = [windows[i][0] for i in ws]
+      terms.append(trajectory_term(kind,state))
+    yield tuple(terms)
+    for (w,step) in zip(windows,steps):
+      w.append(step(w[-1]))
+      w.popleft()
+
+
+def do_it_for_trajectory_family(upto_n,scale,mw,names=None):
+  '''Draw all the sequences in names (by default, all in trajectories, except A080070,
+     whose terms are not binary strings to draw) up to upto_n:th row, computing each
+     distinct orbit only once.'''
+  if names is None: names = sorted([name for name in trajectories if 'binary' != trajectories[name][2]])
+  draw_family(gen_trajectory_family(names),upto_n,scale,mw,names)
+
+
+def do_it_for_trajectory(name,upto_n,scale,mw,every=1000):
+  '''Like do_it_for_A122242 etc., but for any sequence in trajectories, saving a checkpoint every
+     every rows, and after the last one. If a checkpoint and the b-file of an earlier run exist,
+     the terms before the checkpoint are taken from that b-file, and only the rest are computed.
+     The b-file is written here, not by draw_up_to_n, so that it can be flushed before each
+     checkpoint, and thus always contains at least the terms before the last checkpoint.
+     If the checkpoint is already past upto_n, the image is drawn from the b-file alone.'''
+  import os
+  from itertools import chain, islice
+  filebase = sequence_filebase(name)
+  bfilename = "b" + filebase + ".txt"
+  prevname = bfilename + ".prev"
+  gen = None
+  traj = None
+
+  def flush(row):
+    if not bfileout.closed: bfileout.flush()
+
+  saved = load_checkpoint(checkpoint_filename(name),name)
+  if (saved is not None) and os.path.exists(bfilename):
+    (row,state) = saved
+    row = min(row,upto_n)
+    infp = open(bfilename,'r')
+    have = sum([1 for line in infp])
+    infp.close()
+    if row < saved[0] and have >= row: # Nothing new to compute, so keep the b-file as it is.
+      gen = islice(gen_from_bfile(bfilename)(),row)
+      draw_up_to_n(gen,upto_n,scale,filebase,"See: http://oeis.org/"+name,mw,bfile=False)
+      return
+    if have >= row: # Otherwise the earlier run got interrupted before writing them all out.
+      os.rename(bfilename,prevname) # As it is rewritten below.
+      oldterms = islice(gen_from_bfile(prevname,False)(),row)
+      traj = gen_trajectory(name,row,state,every,before_save=flush)
+      gen = chain(oldterms,traj)
+
+  bfileout = open(bfilename,'w')
+
+  def writing(terms):
+    n = 0
+    for x in terms:
+      n += 1
+      bfileout.write(str(n) + " " + int_to_decimal(x) + "\n")
+      yield x
+
+  if gen is None:
+    traj = gen_trajectory(name,every=every,before_save=flush)
+    gen = traj
+  try:
+    draw_up_to_n(writing(gen),upto_n,scale,filebase,"See: http://oeis.org/"+name,mw,bfile=False)
+    if traj is not None: traj.close() # Saves the last checkpoint.
+  finally:
+    bfileout.close()
+  if os.path.exists(prevname): os.remove(prevname)
+
 
 #
 # One-dimensional cellular automata
@@ -763,9 +2488,28 @@ def A269174(n):
     return((n|(n<<1))&((n^(n<<1))|(n^(n<<2))))
 
 
-def genA038184():
-    '''Yield successive terms of A038184, 1, 7, 21, 107, 273, 1911, ... (Rule 150) starting from A038184(0)=1.'''
-    s = 1
+# Rule 150 is linear over GF(2): A048727(n) is n multiplied by 1+x+x^2 in GF(2)[X],
+# thus A038184(n) = (1+x+x^2)^n. As squaring in GF(2)[X] just spreads the bits,
+# (1+x+x^2)^(2^j) = 1 + x^(2^j) + x^(2^(j+1)), so any number of steps can be
+# taken at once with one shift-and-XOR for each 1-bit in the binary expansion of the count.
+
+def A048727_jump(s,k):
+    '''Return A048727 applied k times to s, i.e. s * (1+x+x^2)^k in GF(2)[X], with O(log k) shifts and XORs.'''
+    j = 1
+    while k > 0:
+       if k & 1: s ^= (s<<j)^(s<<(2*j))
+       k >>= 1
+       j <<= 1
+    return(s)
+
+def A038184(n):
+    '''Return the n:th generation of Rule 150 started from a single 1, without computing the previous ones.'''
+    return(A048727_jump(1,n))
+
+
+def genA038184(start=0):
+    '''Yield successive terms of A038184, 1, 7, 21, 107, 273, 1911, ... (Rule 150) starting from A038184(start), by default A038184(0)=1.'''
+    s = A038184(start)
     while True:
        yield s
        s = A048727(s)
@@ -854,14 +2598,222 @@ def genA328103():
 
 def genA328111():
     '''Yield successive terms of A328111 (= A080069(n) OR A267357(n)).'''
+    step = step_map(tb_A057163,A079946,tb_A057164)
     s1 = 1
     s2 = 0
     while True:
        yield (s1|s2)
        s1 = A269174(s1)
-       s2 = tb_A057163(A079946(tb_A057164(s2)))
+       s2 = step(s2)
+
+
+########################################################################
+#
+# Packed elementary cellular automaton engine, for very many generations.
+#
+# The functions above compute each generation with bigint shifts and ORs.
+# Here a generation is kept as a NumPy array of uint64 words (the least
+# significant word first, bit k of the generation being the bit k%64
+# of word k/64), and the next generation is computed with word-level
+# shifts, carrying the bits that cross the word boundaries.
+# Any of the 256 Wolfram rules can be used. The cells outside of the
+# light cone all have the same state, which starts as 0, and changes
+# as the rule says for the neighbourhood 000 or 111.
+#
+# Needs NumPy, e.g.: pip install numpy
+#
+########################################################################
+
+
+def packed_to_int(words,width):
+  '''Convert the first width bits of an array of uint64 words to an integer.'''
+  nw = (width+63) // 64
+  if 0 == nw: return(0)
+  n = int(hexlify(words[:nw].astype('<u8').tobytes()[::-1]),16)
+  return(n & ((1 << width)-1))
+
+def int_to_packed(n,nwords):
+  '''Convert a nonnegative integer to an array of nwords uint64 words.'''
+  h = '%x' % n
+  h = ('0' * ((16*nwords)-len(h))) + h
+  return(numpy.frombuffer(unhexlify(h)[::-1],dtype='<u8').astype(numpy.uint64))
+
+
+def gen_eca_batch_packed(rules,seed=1):
+  '''Evolve len(rules) elementary cellular automata in lockstep, all starting
+     from seed, yielding successive generations as pairs (words,width), where
+     row k of the 2D uint64 array words is the generation of rules[k].
+     Each generation is two bits wider than the previous.
+     Note: words is overwritten by the next generation, so copy it if needed.'''
+
+  if numpy is None: raise ImportError("gen_eca_batch_packed needs NumPy")
+
+  one = numpy.uint64(1)
+  two = numpy.uint64(2)
+  s62 = numpy.uint64(62)
+  s63 = numpy.uint64(63)
+  allones = numpy.uint64(0xFFFFFFFFFFFFFFFF)
+
+  K = len(rules)
+  rules = numpy.array(rules,dtype=numpy.int64)
+
+# For each neighbourhood 4*left+2*middle+right, a column that is all ones
+# in the rows whose rule gives 1 for it, or None (False) if no row's rule
+# (True if every row's rule) gives 1 for it:
+  masks = []
+  for m in range(8):
+    bits = (rules >> m) & 1
+    if not bits.any(): masks.append(None)
+    elif bits.all():   masks.append(True)
+    else:              masks.append((bits.astype(numpy.uint64)*allones).reshape(K,1))
+
+  width = max(1,seed.bit_length())
+  capacity = 0
+  cur = numpy.tile(int_to_packed(seed,(width+63)//64),(K,1))
+  bg = numpy.zeros(K,dtype=numpy.int64) # The state of all the cells outside, for each row.
+
+  while True:
+    yield (cur[:,:(width+63)//64],width)
+
+    nw = (width+2+63) // 64
+    if nw > capacity: # Grow all the work arrays, with plenty of room.
+      capacity = 2*nw + 64
+      old = cur
+      (cur,nxt,q,r,nq,nr,t,f0) = [numpy.zeros((K,capacity),dtype=numpy.uint64) for i in range(8)]
+      cur[:,:old.shape[1]] = old
+
+    p = cur[:,:nw] # The left neighbour of the new cell k is the old cell k.
+    if bg.any(): # Cells width and width+1 are outside, and have the background state.
+      for k in (width,width+1): p[:,k // 64] |= (bg.astype(numpy.uint64) << numpy.uint64(k % 64))
+
+# The middle neighbour is the old cell k-1, and the right one k-2:
+    (qq,rr,tt) = (q[:,:nw],r[:,:nw],t[:,:nw])
+    numpy.left_shift(p,one,qq)
+    numpy.right_shift(p[:,:nw-1],s63,tt[:,1:])
+    qq[:,1:] |= tt[:,1:]
+    qq[:,0] |= bg.astype(numpy.uint64)
+    numpy.left_shift(p,two,rr)
+    numpy.right_shift(p[:,:nw-1],s62,tt[:,1:])
+    rr[:,1:] |= tt[:,1:]
+    rr[:,0] |= (3*bg).astype(numpy.uint64)
+    numpy.invert(qq,nq[:,:nw])
+    numpy.invert(rr,nr[:,:nw])
+
+# new = f0(q,r) if left is 0, f1(q,r) if left is 1, i.e. f0 XOR (left AND (f0 XOR f1)):
+    (ff0,ff1) = (f0[:,:nw],nxt[:,:nw])
+    ff0.fill(0)
+    ff1.fill(0)
+    for (m,a,b) in ((0,nq,nr),(1,nq,r),(2,q,nr),(3,q,r)):
+      if masks[m] is None and masks[m+4] is None: continue
+      numpy.bitwise_and(a[:,:nw],b[:,:nw],tt)
+      for (f,mask) in ((ff0,masks[m]),(ff1,masks[m+4])):
+        if mask is True: f |= tt
+        elif mask is not None: f |= (tt & mask)
+    ff1 ^= ff0
+    ff1 &= p
+    ff1 ^= ff0
+
+    width += 2
+    if width % 64: ff1[:,nw-1] &= numpy.uint64((1 << (width % 64))-1)
+    bg = (rules >> (7*bg)) & 1
+    (cur,nxt) = (nxt,cur) # Words past nw stay zero in both.
+
+
+def gen_eca_packed(rule,seed=1):
+  '''Yield successive generations of the elementary cellular automaton rule,
+     starting from seed, as pairs (words,width), where words is a uint64 array
+     of (width+63)/64 words. Each generation is two bits wider than the previous.
+     Note: words is overwritten by the next generation, so copy it if needed.'''
+  for (words,width) in gen_eca_batch_packed([rule],seed): yield (words[0],width)
+
+
+def gen_eca(rule,seed=1):
+  '''Yield successive generations of the elementary cellular automaton rule
+     as integers, e.g. gen_eca(30) gives the same terms as genA110240().'''
+  for (words,width) in gen_eca_packed(rule,seed): yield packed_to_int(words,width)
+
+
+def eca_generation(rule,n,seed=1):
+  '''Return the n:th generation (the seed being the 0th) of rule as an integer.'''
+  g = gen_eca_packed(rule,seed)
+  while n > 0:
+    next(g)
+    n -= 1
+  (words,width) = next(g)
+  return(packed_to_int(words,width))
+
+
+
+# The 1D-CA sequences above that are combinations of one or two automata
+# started from a single 1, as (rule_a, op, rule_b, shift, lag), meaning
+# a(n) = CA_a(n+lag) op (CA_b(n) << shift). op None means just CA_a(n).
+# gen_ca_family evolves all the distinct rules needed in lockstep,
+# so e.g. Rule 30 is computed only once for all the sequences below,
+# and the combinations are applied afterwards to the rows of each generation.
+
+ca_sequences = {
+  'A110240' : (30,None,None,0,0),
+  'A265281' : (86,None,None,0,0),
+  'A267357' : (124,None,None,0,0),
+  'A038184' : (150,None,None,0,0),
+  'A327971' : (30,'xor',86,0,0),  # A110240(n) XOR A265281(n)
+  'A327972' : (30,'xor',150,0,0), # A110240(n) XOR A038184(n)
+  'A327973' : (30,'xor',30,1,1),  # A110240(n+1) XOR 2*A110240(n)
+  'A327976' : (30,'xor',86,1,1),  # A110240(n+1) XOR 2*A265281(n)
+  'A328103' : (124,'xor',30,0,0), # A267357(n) XOR A110240(n)
+  'A328104' : (30,'or',30,1,0),   # A110240(n) OR 2*A110240(n)
+}
+
+ca_post_ops = {
+  None  : (lambda a,b: a),
+  'xor' : (lambda a,b: a^b),
+  'or'  : (lambda a,b: a|b),
+  'and' : (lambda a,b: a&b),
+}
+
+
+# Rules with a closed formula above. For these, Python's own long integer
+# operations are faster than gen_eca_batch_packed, at least up to
+# some tens of thousands of generations:
+eca_int_steps = { 30 : A269160, 86 : A269161, 124 : A269174, 150 : A048727 }
+
+
+def gen_eca_rows(rules,seed=1):
+  '''Yield lists containing the successive generations of each rule in rules as integers.'''
+  if numpy is None or all([rule in eca_int_steps for rule in rules]):
+    steps = [eca_int_steps[rule] for rule in rules]
+    rows = [seed] * len(rules)
+    while True:
+      yield rows
+      rows = [step(row) for (step,row) in zip(steps,rows)]
+  else:
+    for (words,width) in gen_eca_batch_packed(rules,seed):
+      yield [packed_to_int(words[i],width) for i in range(len(rules))]
+
+
+def gen_ca_family(names,defs=ca_sequences):
+  '''Yield tuples containing the successive terms of the sequences named in names
+     (keys of defs), the n:th tuple containing the n:th term of each.'''
+  specs = [defs[name] for name in names]
+  rules = sorted(set([spec[0] for spec in specs] + [spec[2] for spec in specs if spec[1] is not None]))
+  row_of = dict([(rule,i) for (i,rule) in enumerate(rules)])
+  ops = [(row_of[a],ca_post_ops[op],row_of.get(b,0),shift,lag) for (a,op,b,shift,lag) in specs]
+
+# Each term needs rows of generations n and n+1 at most, so we are always one generation behind:
+  prev = None
+  for cur in gen_eca_rows(rules):
+    if prev is not None:
+      yield tuple([op((cur if lag else prev)[a],prev[b]<<shift) for (a,op,b,shift,lag) in ops])
+    prev = cur
+
+
+def gen_ca_sequence(name):
+  '''Yield successive terms of the sequence name given in ca_sequences, e.g. gen_ca_sequence('A327971').'''
+  for terms in gen_ca_family([name]): yield terms[0]
+
+
+
 
-       
 ########################################################################
 #
 #
@@ -880,8 +2832,43 @@ def genA328111():
 # with (0, 0) in the upper left corner.
 # Can be installed in Ubuntu with shell command pip install Pillow
 # (and with sudo apt install python-pip before that, if needed)
+# PIL is imported only inside the functions that draw, so that the integer
+# functions can be used (and this module imported) without loading it.
+
+import zlib
+
+# The canvases can be 24-bit 'RGB' (the default), 'P' with a palette of just
+# the three colours used (saved by PIL as a PNG of 2 bits per pixel), or bilevel '1',
+# half of that again, but with no room for the background colour, which is
+# then drawn white, like the 0's.
+# png_compress_level (0-9) and png_compress_type (the zlib strategy, e.g. zlib.Z_FILTERED,
+# zlib.Z_HUFFMAN_ONLY or 3 for Z_RLE) trade the encoding time against the file size.
+# With png_compress_type None, PIL picks the strategy itself for the images it saves.
+
+image_mode = 'RGB'
+png_compress_level = 6
+png_compress_type = None
+
+# Palette indices of the 'P' canvases. The background colour is the last one.
+palette_black = 0
+palette_white = 1
+palette_background = 2
+
+def new_canvas(width,height,background):
+  '''Return a new image of image_mode, filled with background, given as an RGB triple.'''
+  from PIL import Image
+  if '1' == image_mode: return(Image.new('1',(width,height),1))
+  if 'P' == image_mode:
+    image = Image.new('P',(width,height),palette_background)
+    image.putpalette([0,0,0, 255,255,255] + list(background))
+    return(image)
+  return(Image.new('RGB',(width,height),background))
+
+
+def save_png(image,filename):
+  if png_compress_type is None: image.save(filename,"png",compress_level=png_compress_level)
+  else: image.save(filename,"png",compress_level=png_compress_level,compress_type=png_compress_type)
 
-from PIL import Image, ImageDraw, ImageFont
 
 def draw_point(draw,x,y,scale,color):
   pixrange = range(scale)
@@ -905,52 +2892,396 @@ def draw_bin_string(draw,row,scale,width,height,ymargin,binstr):
     x -= scale
 
 
-def draw_up_to_n(gen,upto_n,scale,filebase,captext,maxwidth):
+# Bulk rasterizer. Instead of issuing scale*scale ImageDraw.point calls per bit,
+# the visible bits of the row are turned into one 8-bit grayscale scanline
+# (via bin() and a byte translation table), expanded to scale x scale blocks
+# with a nearest-neighbour resize, and pasted into the image in one go.
+# Produces exactly the same pixels as draw_bin_string above, including
+# the cropping at the left and right edges when maxwidth is used.
+
+bits_to_gray = bytearray(range(256))
+bits_to_gray[ord('0')] = 255 # 0's are white.
+bits_to_gray[ord('1')] = 0   # 1's are black.
+
+gray_to_palette = bytearray(256)
+gray_to_palette[255] = palette_white
+
+def draw_bin_row(image,row,scale,width,ymargin,binstr):
+  '''Draw binstr on the given row of image, like draw_bin_string, but with a single paste.'''
+  if binstr <= 0: return
+  nbits = binstr.bit_length()
+  x = (width-1) - ( (width-scale*nbits) // 2 ) # Right edge of the least significant bit.
+  y = scale*(row - 1) + ymargin
+
+# Bits whose right edge falls outside the image are not drawn at all:
+  if(x < width): kmin = 0
+  else:          kmin = ((x-width) // scale) + 1
+  kmax = min(nbits-1, x // scale)
+  if kmax < kmin: return
+
+  bits = bin(binstr)[2:][(nbits-1-kmax):(nbits-kmin)]
+  draw_gray_row(image,x-(scale*kmax),y,scale,bytearray(bits).translate(bits_to_gray))
+
+
+def draw_gray_row(image,x,y,scale,pixels):
+  '''Paste a row of grayscale pixels (a bytearray, one byte per bit) into image,
+     each as a scale x scale block, the leftmost block ending at column x.'''
+  from PIL import Image
+  m = len(pixels)
+  if 0 == m: return
+  if 'P' == image.mode: line = Image.frombytes("P",(m,1),str(pixels.translate(gray_to_palette)))
+  else:                 line = Image.frombytes("L",(m,1),str(pixels)) # Converted by paste.
+  if scale > 1: line = line.resize((scale*m,scale),Image.NEAREST)
+  left = x - scale + 1
+  if left < 0:
+    if left <= -(scale*m): return
+    line = line.crop((-left,0,scale*m,scale))
+    left = 0
+  image.paste(line,(left,y))
+
+
+def bench_rasterizer(upto_n,scale,maxwidth=0):
+  '''Compare draw_bin_string and draw_bin_row on the first upto_n terms of A122242,
+     printing pixels per second for both and whether the images are identical.'''
+  from PIL import Image, ImageDraw
+  from time import time
+
+  rows = take(upto_n,genA122242())
+  if(maxwidth>0): width = maxwidth
+  else:           width = 2*(scale*upto_n) + (scale*rows[0].bit_length())
+  height = (scale*upto_n) + 2
+  pixels = scale*scale*sum([r.bit_length() for r in rows])
+
+  image1 = Image.new("RGB",(width,height),(128,000,000))
+  draw = ImageDraw.Draw(image1)
+  t = time()
+  for row in range(1,upto_n+1): draw_bin_string(draw,row,scale,width,height,1,rows[row-1])
+  t1 = time()-t
+  del draw
+
+  image2 = Image.new("RGB",(width,height),(128,000,000))
+  t = time()
+  for row in range(1,upto_n+1): draw_bin_row(image2,row,scale,width,1,rows[row-1])
+  t2 = time()-t
+
+  print 'draw_bin_string: ' + str(t1) + ' s, ' + str(int(pixels/max(t1,1e-9))) + ' pixels/s'
+  print 'draw_bin_row:    ' + str(t2) + ' s, ' + str(int(pixels/max(t2,1e-9))) + ' pixels/s'
+  print 'Identical images: ' + str(image1.tobytes() == image2.tobytes())
+
+
+def draw_up_to_n(gen,upto_n,scale,filebase,captext,maxwidth,start=0,bfile=True):
   '''Draw binary strings produced by generator gen, up to upto_n:th row, saving
-     the image to the file, with additional caption "captext", if present.'''
+     the image to the file, with additional caption "captext", if present.
+     If the first term of gen is not the first term of the sequence, but the start:th
+     one after it, give start, for the b-file indices and the caption.
+     With bfile=False the b-file is not written, e.g. when redrawing from a row store.'''
+  from PIL import ImageDraw
+
+  if use_pipeline and bfile:
+    return(draw_pipelined(gen,upto_n,scale,filebase,captext,maxwidth,start))
 
-  bfileout = open("b"+filebase+".txt",'w')
+  if scale*upto_n > stream_above_height:
+    return(stream_up_to_n(gen,upto_n,scale,filebase,captext,maxwidth,start,bfile))
+
+  if bfile: (bfile_write,bfile_close) = open_bfile_writer("b"+filebase+".txt",start,bfile_companion)
 
   row = 1
   xmargin = 0
   ymargin = 1
 
 
+  try:
 # Take the first integer returned by the generator gen:
-  for binstr in gen:
-    bfileout.write(str(row)+" "+str(binstr)+"\n")
-    break
+    for binstr in gen:
+      if bfile: bfile_write(binstr)
+      break
 
-  firstwid = (A000523(binstr)+1)
+    firstwid = (A000523(binstr)+1)
 
-  if(maxwidth>0): width = maxwidth
-  else:           width = 2*(scale*upto_n) + (scale*firstwid) + 2*xmargin
-  height = (scale*upto_n) + 2*ymargin
-  image = Image.new("RGB",(width,height),(128,000,000)) # Nice red background
-  draw = ImageDraw.Draw(image)
-  draw_bin_string(draw,row,scale,width,height,ymargin,binstr)
+    if(maxwidth>0): width = maxwidth
+    else:           width = 2*(scale*upto_n) + (scale*firstwid) + 2*xmargin
+    height = (scale*upto_n) + 2*ymargin
+    image = new_canvas(width,height,(128,000,000)) # Nice red background
+    draw = ImageDraw.Draw(image)
+    draw_bin_row(image,row,scale,width,ymargin,binstr)
 
-  row += 1
+    row += 1
 
 # And then the rest:
-  for binstr in gen:
-    bfileout.write(str(row)+" "+str(binstr)+"\n")
-    draw_bin_string(draw,row,scale,width,height,ymargin,binstr)
-    row += 1
-    if row > upto_n: break
+    for binstr in gen:
+      if bfile: bfile_write(binstr)
+      draw_bin_row(image,row,scale,width,ymargin,binstr)
+      row += 1
+      if row > upto_n: break
 
-  bfileout.close()
+  finally:
+    if bfile: bfile_close() # Also when interrupted, so that the rows so far are kept.
 
-  if(captext):
-    # font = ImageFont.load("some_larger_font.pil") # But we don't have it!
-    font = ImageFont.load_default()
-    draw.text((10,10), captext, fill=(0,0,0), font=font) # Text in black.
-    draw.text((10,25), "First "+str(upto_n)+" terms, 1 bit = "
-                       + str(scale) + "x" + str(scale) + " pixels.",
-                       fill=(0,0,0), font=font)
+  if(captext): draw_caption(draw,captext,upto_n,scale,start)
 
   del draw
-  image.save("a" + filebase + "_" + str(upto_n) + ".png","png")
+  save_png(image,"a" + filebase + "_" + str(upto_n) + ".png")
+
+
+def draw_caption(draw,captext,upto_n,scale,start):
+  '''Write captext and a line telling which terms are shown to the upper left corner.'''
+  from PIL import ImageFont
+  # font = ImageFont.load("some_larger_font.pil") # But we don't have it!
+  font = ImageFont.load_default()
+  if 'RGB' == draw.im.mode: black = (0,0,0)
+  else:                     black = palette_black # Also 0 in the bilevel images.
+  draw.text((10,10), captext, fill=black, font=font) # Text in black.
+  if start > 0: which = str(upto_n)+" terms after the first "+str(start)
+  else:         which = "First "+str(upto_n)+" terms"
+  draw.text((10,25), which + ", 1 bit = "
+                     + str(scale) + "x" + str(scale) + " pixels.",
+                     fill=black, font=font)
+
+
+# Streaming version of draw_up_to_n, for images too tall to keep in memory.
+# The PNG file is written directly, one scanline at a time, compressed with
+# zlib into IDAT chunks as the rows are produced, so the memory needed
+# depends only on the width. The caption is drawn with PIL into a buffer
+# holding just the topmost caption_height scanlines, before they are written.
+# draw_up_to_n switches to this automatically when the image would be
+# taller than stream_above_height pixels. The scanlines are kept as palette
+# indices, and converted to the bytes of image_mode only when compressed.
+
+stream_above_height = 8192
+caption_height = 40
+idat_size = 1 << 18 # Write an IDAT chunk whenever this many compressed bytes are pending.
+
+def png_chunk(fp,tag,data):
+  fp.write(struct.pack('>I',len(data)))
+  fp.write(tag)
+  fp.write(data)
+  fp.write(struct.pack('>I',zlib.crc32(tag+data) & 0xffffffff))
+
+
+bits_to_palette = bytearray(range(256))
+bits_to_palette[ord('0')] = palette_white
+bits_to_palette[ord('1')] = palette_black
+
+palette_digits = bytearray('0123') + bytearray(range(4,256))
+palette_to_bilevel = bytearray(range(256))
+palette_to_bilevel[palette_background] = palette_white
+
+def bin_row_scanline(binstr,scale,width,background):
+  '''Return one scanline (palette indices, one byte per pixel) of the row where binstr
+     is drawn as by draw_bin_row.'''
+  line = background[:]
+  if binstr <= 0: return(line)
+  nbits = binstr.bit_length()
+  x = (width-1) - ( (width-scale*nbits) // 2 ) # Right edge of the least significant bit.
+  if(x < width): kmin = 0
+  else:          kmin = ((x-width) // scale) + 1
+  kmax = min(nbits-1, x // scale)
+  if kmax < kmin: return(line)
+
+  indices = bytearray(bin(binstr)[2:][(nbits-1-kmax):(nbits-kmin)]).translate(bits_to_palette)
+  m = len(indices)
+  pixels = bytearray(scale*m)
+  for k in range(scale): pixels[k::scale] = indices # Each bit to scale pixels.
+  left = x - scale*kmax - scale + 1
+  if left < 0:
+    pixels = pixels[-left:]
+    left = 0
+  line[left:left+len(pixels)] = pixels
+  return(line)
+
+
+def pack_scanline(indices,bits):
+  '''Pack a scanline of pixel values below 4 to bits (1, 2 or 8) per pixel, the leftmost
+     pixel in the most significant bits, as the PNG format wants them.'''
+  if 8 == bits: return(str(indices))
+  perbyte = 8 // bits
+  pad = (-len(indices)) % perbyte
+  n = int(str(indices.translate(palette_digits)) + ('0' * pad), 1 << bits)
+  return(unhexlify('%0*x' % (2*((len(indices)+pad)//perbyte), n)))
+
+
+def scanline_encoder(palette):
+  '''Return the PNG header fields (bit depth, colour type), the PLTE data (or None)
+     and a function converting the scanlines of palette indices to the bytes written
+     for them, all according to image_mode. palette is a list of the RGB triples.'''
+  if '1' == image_mode:
+    return((1,0,None,lambda line: pack_scanline(line.translate(palette_to_bilevel),1)))
+  if 'P' == image_mode:
+    return((2,3,str(bytearray(sum(palette,()))),lambda line: pack_scanline(line,2)))
+  channels = [bytearray([c[i] for c in palette]) + bytearray(256-len(palette)) for i in range(3)]
+  def rgb(line):
+    data = bytearray(3*len(line))
+    for i in range(3): data[i::3] = line.translate(channels[i])
+    return(str(data))
+  return((8,2,None,rgb))
+
+
+def stream_up_to_n(gen,upto_n,scale,filebase,captext,maxwidth,start=0,bfile=True):
+  '''Same as draw_up_to_n, but writing the PNG file as the rows come, without
+     keeping the whole image in memory.'''
+  from PIL import Image, ImageDraw
+
+  xmargin = 0
+  ymargin = 1
+
+  gen = iter(gen)
+  try:
+    binstr = next(gen)
+  except StopIteration:
+    binstr = None # Nothing to write to the b-file.
+
+  firstwid = (A000523(binstr or 0)+1)
+  if(maxwidth>0): width = maxwidth
+  else:           width = 2*(scale*upto_n) + (scale*firstwid) + 2*xmargin
+  height = (scale*upto_n) + 2*ymargin
+  palette = [(0,0,0),(255,255,255),(128,000,000)] # Nice red background
+  background = bytearray([palette_background]) * width
+  (depth,colortype,plte,encode) = scanline_encoder(palette)
+
+  pngout = open("a" + filebase + "_" + str(upto_n) + ".png","wb")
+  pngout.write('\x89PNG\r\n\x1a\n')
+  png_chunk(pngout,'IHDR',struct.pack('>IIBBBBB',width,height,depth,colortype,0,0,0))
+  if plte: png_chunk(pngout,'PLTE',plte)
+  if png_compress_type is None: strategy = zlib.Z_DEFAULT_STRATEGY
+  else:                         strategy = png_compress_type
+  compressor = zlib.compressobj(png_compress_level,zlib.DEFLATED,15,8,strategy)
+  pending = [] # Compressed data not yet written,
+  pendingsize = [0] # and its total length.
+  top = [] # The scanlines under the caption, until it has been drawn.
+  if captext: topsize = min(caption_height,height)
+  else:       topsize = 0
+
+  def compress(line):
+    c = compressor.compress('\x00' + encode(line)) # Filter type 0 (None).
+    if c:
+      pending.append(c)
+      pendingsize[0] += len(c)
+      if pendingsize[0] >= idat_size: flush()
+
+  def flush(final=False):
+    if final: pending.append(compressor.flush())
+    data = ''.join(pending)
+    if data: png_chunk(pngout,'IDAT',data)
+    del pending[:]
+    pendingsize[0] = 0
+
+  def emit(line,count):
+    for i in xrange(count):
+      if len(top) < topsize:
+        top.append(line)
+        if len(top) == topsize: # Now draw the caption on them, and write them out.
+          image = Image.frombytes("P",(width,topsize),str(bytearray().join(top)))
+          draw = ImageDraw.Draw(image)
+          draw_caption(draw,captext,upto_n,scale,start)
+          del draw
+          data = bytearray(image.tobytes())
+          for y in xrange(topsize): compress(data[width*y:width*(y+1)])
+      else: compress(line)
+
+  if bfile: (bfile_write,bfile_close) = open_bfile_writer("b"+filebase+".txt",start,bfile_companion)
+  try:
+    if bfile and (binstr is not None): bfile_write(binstr)
+
+    emit(background,ymargin)
+    emit(bin_row_scanline(binstr or 0,scale,width,background),scale)
+    row = 2
+
+    for binstr in gen:
+      if bfile: bfile_write(binstr)
+      if row <= upto_n: emit(bin_row_scanline(binstr,scale,width,background),scale)
+      row += 1
+      if row > upto_n: break
+
+  finally:
+    if bfile: bfile_close() # Also when interrupted, so that the rows so far are kept.
+
+  if row <= upto_n: emit(background,scale*(upto_n+1-row)) # The generator ended early.
+  emit(background,ymargin)
+  flush(True)
+  png_chunk(pngout,'IEND','')
+  pngout.close()
+
+
+# Pipelined drawing. The terms are computed by the generator in a producer process,
+# which hands each one over both to a process writing the b-file and to the caller,
+# which draws them, through bounded queues, so that no stage can get more than
+# pipeline_queue_size terms ahead of the others. On a multi-core machine the total
+# time then approaches that of the slowest stage, instead of the sum of them all.
+# With use_pipeline set, draw_up_to_n (and so every do_it_for_*) draws this way.
+
+use_pipeline = False
+pipeline_queue_size = 8
+
+def pipeline_producer(gen,upto_n,queues):
+  '''Put the first upto_n terms of gen to each of queues, and then None.
+     If gen fails, its traceback is put instead, as a string.'''
+  from itertools import islice
+  try:
+    for x in islice(gen,upto_n):
+      for q in queues: q.put(x)
+  except BaseException: # Also KeyboardInterrupt, so that the others stop and keep what they got.
+    from traceback import format_exc
+    for q in queues: q.put(format_exc())
+    return
+  for q in queues: q.put(None)
+
+
+def pipeline_bfile_writer(queue,filename,start):
+  '''Write the terms coming from queue to the b-file filename, indexed from start+1.'''
+  (write,close) = open_bfile_writer(filename,start,bfile_companion)
+  try:
+    while True:
+      x = queue.get()
+      if x is None or isinstance(x,str): break
+      write(x)
+  finally:
+    close()
+
+
+def gen_pipelined(gen,upto_n,filename=None,start=0):
+  '''Yield the first upto_n terms of gen, computed in a separate process, while another
+     process writes them to the b-file filename (if given), indexed from start+1.
+     The b-file is complete when this generator has been exhausted or closed.'''
+  from multiprocessing import Process, Queue
+  terms = Queue(pipeline_queue_size)
+  queues = [terms]
+  if filename: queues.append(Queue(pipeline_queue_size))
+  workers = [Process(target=pipeline_producer,args=(gen,upto_n,queues))]
+  if filename: workers.append(Process(target=pipeline_bfile_writer,args=(queues[1],filename,start)))
+  for w in workers:
+    w.daemon = True
+    w.start()
+
+  count = 0
+  ended = False
+  try:
+    while count < upto_n:
+      x = terms.get()
+      if x is None:
+        ended = True
+        break
+      if isinstance(x,str):
+        ended = True
+        raise RuntimeError("Generator failed in the producer process:\n" + x)
+      count += 1
+      yield x
+  finally:
+    if ended or count == upto_n:
+      for w in workers: w.join()
+    else: # Given up before the end, the workers might wait forever.
+      for w in workers:
+        w.terminate()
+        w.join()
+
+
+def draw_pipelined(gen,upto_n,scale,filebase,captext,maxwidth,start=0):
+  '''Same as draw_up_to_n, but with the terms computed and the b-file written
+     in their own processes, concurrently with the drawing.'''
+  terms = gen_pipelined(gen,upto_n,"b"+filebase+".txt",start)
+  try:
+    draw_up_to_n(terms,upto_n,scale,filebase,captext,maxwidth,start,bfile=False)
+  finally:
+    terms.close() # Waits until the b-file has been written.
 
 ########################################################################
 
@@ -961,9 +3292,7 @@ def draw_binseq_from_bfile(filebase,firstwid,scale,captext):
      drawing the first firstwid bits centered on the top row,
      and after that two bits more on each row.
      Save the image to the file, with additional caption "captext".'''
-
-  black = (0,0,0)
-  white = (256,256,256)
+  from PIL import ImageDraw
 
   try:
     bfilein = open("b"+filebase+".txt",'r')
@@ -996,7 +3325,7 @@ def draw_binseq_from_bfile(filebase,firstwid,scale,captext):
   print 'Drawing image of width x height ' + str(width) + 'x' + str(height) + ' pixels. ' + str(rows) + ' rows, first row is ' + str(firstwid) + ' bits, x_start = ' + str(x_start) + '\n'
 
 # image = Image.new("RGB",(width,height),(128,000,000)) # Nice red background
-  image = Image.new("RGB",(width,height),(000,000,128)) # Nice blue background
+  image = new_canvas(width,height,(000,000,128)) # Nice blue background
   draw = ImageDraw.Draw(image)
 
   widthnow = firstwid
@@ -1005,7 +3334,7 @@ def draw_binseq_from_bfile(filebase,firstwid,scale,captext):
   linepat = re.compile(r'^([0-9]+)\s+([0-9]+)')
 
   y = ymargin
-  x = x_start
+  rowbits = bytearray() # Bits of the current row, collected as grayscale pixels.
 
 # Then read the bfile in again:
   for line in bfilein.xreadlines():
@@ -1013,38 +3342,30 @@ def draw_binseq_from_bfile(filebase,firstwid,scale,captext):
     if(m):
       lineno = int(m.group(1))
       bit    = int(m.group(2))
-      if(0 == bit): color = white # 0's are black.
-      else:         color = black # 1's are white.
-
-      draw_point(draw,x,y,scale,color)
+      if(0 == bit): rowbits.append(255) # 0's are white.
+      else:         rowbits.append(0)   # 1's are black.
 
       w -= 1
       if(0==w): # Time to change to the next row?
+        draw_gray_row(image,x_start,y,scale,rowbits)
+        rowbits = bytearray()
         widthnow += 2 # It's two bits wider
         w = widthnow
         y += scale    # Towards bottom of the screen...
         x_start -= scale # And the next row one block more left
-        x = x_start
-      else:
-        x += scale
 
     else:
       print 'Comment-line or ill-formed, skipping: ' + line + '\n'
       continue
 
+  draw_gray_row(image,x_start,y,scale,rowbits) # The last, incomplete row, if any.
   bfilein.close()
 
-  if(captext):
-    # font = ImageFont.load("some_larger_font.pil") # But we don't have it!
-    font = ImageFont.load_default()
-    draw.text((10,10), captext, fill=(0,0,0), font=font) # Text in black.
-    draw.text((10,25), "First "+str(upto_n)+" terms, 1 bit = "
-                       + str(scale) + "x" + str(scale) + " pixels.",
-                       fill=(0,0,0), font=font)
+  if(captext): draw_caption(draw,captext,upto_n,scale,0)
 
   del draw
-# image.save("a" + filebase + "_" + str(upto_n) + ".png","png")
-  image.save("a" + filebase + "_p" + str(scale) + ".png","png")
+# save_png(image,"a" + filebase + "_" + str(upto_n) + ".png")
+  save_png(image,"a" + filebase + "_p" + str(scale) + ".png")
 
 
 ########################################################################
@@ -1085,6 +3406,9 @@ def do_it_for_A179417(upto_n,scale,mw):
   draw_up_to_n(genA179417(),upto_n,scale,"179417","See: http://oeis.org/A179417",mw)
 
 
+def do_it_for_quadratic_residue_triangle(p,upto_n,scale,mw):
+  draw_up_to_n(gen_quadratic_residue_triangle(p),upto_n,scale,"QR_mod_"+str(p),"Quadratic residues mod "+str(p)+", A179417-style",mw)
+
 def do_it_for_A218776(upto_n,scale,mw):
   draw_up_to_n((gen_from_bfile("b218776.upto4096.txt"))(),upto_n,scale,"218776","See: http://oeis.org/A218776",mw)
 
@@ -1141,6 +3465,11 @@ def do_it_for_A0new15(upto_n,scale,mw):
 def do_it_for_A0new16(upto_n,scale,mw):
   draw_up_to_n(genA0new16(),upto_n,scale,"900016","See: http://oeis.org/A0new16",mw)
 
+def do_it_for_A038184(upto_n,scale,mw,start=0):
+  if start > 0: filebase = "038184_from_"+str(start)
+  else:         filebase = "038184"
+  draw_up_to_n(genA038184(start),upto_n,scale,filebase,"See: http://oeis.org/A038184",mw,start)
+
 def do_it_for_A110240(upto_n,scale,mw):
   draw_up_to_n(genA110240(),upto_n,scale,"110240","See: http://oeis.org/A110240",mw)
 
@@ -1168,6 +3497,12 @@ def do_it_for_A328104(upto_n,scale,mw):
 def do_it_for_A328111(upto_n,scale,mw):
   draw_up_to_n(genA328111(),upto_n,scale,"328111","See: http://oeis.org/A328111",mw)
 
+def do_it_for_CA_family(upto_n,scale,mw,names=None):
+  '''Draw all the sequences in names (by default, all in ca_sequences) up to upto_n:th row,
+     evolving each distinct automaton only once.'''
+  if names is None: names = sorted(ca_sequences.keys())
+  draw_family(gen_ca_family(names),upto_n,scale,mw,names)
+
 def do_it_for_A376402(upto_n,scale,mw):
   draw_up_to_n(genA376402(),upto_n,scale,"376402","See: http://oeis.org/A376402",mw)
 
@@ -1181,9 +3516,91 @@ def do_it_for_A376415(upto_n,scale,mw):
   draw_up_to_n(genA376415(),upto_n,scale,"376415","See: http://oeis.org/A376415",mw)
 
 
+# Batch runner. Each job is (seqid, upto_n, scale, mw), where seqid names the function
+# do_it_for_seqid, e.g. 'A080069', or is a tuple of that name and the arguments given
+# before upto_n, e.g. ('quadratic_residue_triangle',65537) or ('trajectory','A0new3').
+# The jobs are run on a pool of processes, one fresh process per job, the longest
+# expected job first, so that the last ones to finish are short. The expected cost is
+# taken from costs (a dict from seqid to seconds, e.g. from the results of an earlier
+# run), if there, otherwise estimated from the number of pixels drawn.
+# A failing job is reported with its traceback, and the others run on.
+
+def batch_job_function(seqid):
+  '''Return the do_it_for_* function and the leading arguments for seqid.'''
+  if isinstance(seqid,tuple): return((globals()["do_it_for_"+seqid[0]],seqid[1:]))
+  return((globals()["do_it_for_"+seqid],()))
+
+
+def batch_job_cost(job,costs=None):
+  (seqid,upto_n,scale,mw) = job
+  if costs and seqid in costs: return(costs[seqid])
+  if mw > 0: return(1e-7 * upto_n * (upto_n + scale*mw))
+  return(1e-7 * upto_n * upto_n * (1 + 2*scale*scale))
+
+
+# These redraw several sequences at once, to the same files as their own
+# do_it_for_* functions, so running them with those would have two processes
+# writing the same b-files and images, and computing everything twice:
+batch_family_drivers = ('CA_family','trajectory_family')
+
+def batch_all_jobs(upto_n,scale,mw):
+  '''Return a job for every do_it_for_* taking just (upto_n,scale,mw), except the family
+     drivers, e.g. to redraw them all.'''
+  names = [name for (name,f) in globals().items() if name.startswith("do_it_for_")
+                 and f.func_code.co_varnames[:3] == ('upto_n','scale','mw')
+                 and name[len("do_it_for_"):] not in batch_family_drivers]
+  return([(name[len("do_it_for_"):],upto_n,scale,mw) for name in sorted(names)])
+
+
+def run_batch_job(job):
+  '''Run one job, returning (seqid, seconds, peak memory in kilobytes, traceback or None).'''
+  import resource
+  from time import time
+  from traceback import format_exc
+  (seqid,upto_n,scale,mw) = job
+  t = time()
+  try:
+    (fun,args) = batch_job_function(seqid)
+    fun(*(args + (upto_n,scale,mw)))
+    error = None
+  except Exception:
+    error = format_exc()
+  return((seqid,time()-t,resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,error))
+
+
+def run_batch(jobs,processes=None,costs=None):
+  '''Run the jobs on a process pool, the longest expected first, printing each one's time
+     and peak memory as they finish, and a summary at the end. Returns the results as
+     a list of (seqid, seconds, peak kilobytes, traceback or None), in the finishing order.'''
+  from multiprocessing import Pool
+  from time import time
+
+  jobs = sorted(jobs,key=lambda job: -batch_job_cost(job,costs))
+  t = time()
+  pool = Pool(processes,maxtasksperchild=1) # A fresh process for each job, for its peak memory.
+  results = []
+  try:
+    for result in pool.imap_unordered(run_batch_job,jobs):
+      (seqid,secs,maxrss,error) = result
+      if error: print str(seqid) + ' FAILED after ' + str(round(secs,2)) + ' s:\n' + error
+      else:     print str(seqid) + ': ' + str(round(secs,2)) + ' s, peak ' + str(maxrss//1024) + ' MB'
+      results.append(result)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+  failed = [r[0] for r in results if r[3]]
+  print str(len(results)-len(failed)) + ' jobs done in ' + str(round(time()-t,2)) + ' s (' + str(round(sum([r[1] for r in results]),2)) + ' s in total)'
+  if failed: print 'Failed: ' + ', '.join(map(str,failed))
+  return(results)
+
+
 # Invoke any of the above like this:
 
-do_it_for_A080069(2048, 1, 0)
+# do_it_for_A080069(2048, 1, 0)
 
 # do_it_for_A376405(2048, 1, 0)
 
@@ -1191,6 +3608,105 @@ do_it_for_A080069(2048, 1, 0)
 
 # do_it_for_A122242(20000, 1, 1401)
 
+# or many of them at once:
+
+# run_batch(batch_all_jobs(2048, 1, 0))
+
+# or from the command line, e.g.:
+
+#   python a080069.py A080069 2048 1 0
+#   python a080069.py A122242 20000 1 1401 --format bilevel
+#   python a080069.py all 2048 --processes 4
+#   python a080069.py quadratic_residue_triangle 200 2 --arg 65537
+#   python a080069.py trajectory 5000 --arg A122242
+#   python a080069.py --check-import-time 0.5
+
+# Importing this module does nothing else than define the functions and tables,
+# and check_import_time verifies that it stays that way, and fast.
+
+image_formats = {'rgb':'RGB', 'palette':'P', 'bilevel':'1'}
+import_time_budget = 0.5 # Seconds.
+
+def check_import_time(budget=None,tries=3):
+  '''Import this module in a fresh interpreter, in an empty directory, and check that
+     it takes at most budget seconds (the best of tries), leaves PIL unloaded and
+     writes no files. Returns True if so, otherwise prints what failed and returns False.'''
+  import os, shutil, subprocess, sys, tempfile
+  if budget is None: budget = import_time_budget
+  (moddir,modfile) = os.path.split(os.path.abspath(__file__))
+  script = ("import sys, time; sys.path.insert(0,%r); t = time.time(); import %s; "
+            "print time.time()-t, 'PIL' in sys.modules") % (moddir,os.path.splitext(modfile)[0])
+  tmpdir = tempfile.mkdtemp()
+  try:
+    runs = [subprocess.check_output([sys.executable,"-c",script],cwd=tmpdir).split() for i in range(tries)]
+    written = os.listdir(tmpdir)
+  finally:
+    shutil.rmtree(tmpdir)
+
+  secs = min([float(r[0]) for r in runs])
+  ok = True
+  print 'Import took ' + str(round(secs,3)) + ' s, budget ' + str(budget) + ' s.'
+  if secs > budget:
+    print 'Import is over the budget!'
+    ok = False
+  if 'True' in [r[1] for r in runs]:
+    print 'Import loaded PIL!'
+    ok = False
+  if written:
+    print 'Import wrote files: ' + ', '.join(written)
+    ok = False
+  return(ok)
+
+
+def main(argv=None):
+  '''Command line entry point. Returns the exit status.'''
+  global image_mode, png_compress_level, use_pipeline
+  import argparse
+  parser = argparse.ArgumentParser(description="Draw the sequences of this module as PNG images, writing their b-files.")
+  parser.add_argument("seqid",nargs='?',help="e.g. A080069 for do_it_for_A080069, or 'all' for all of them")
+  parser.add_argument("rows",nargs='?',type=int,default=2048)
+  parser.add_argument("scale",nargs='?',type=int,default=1,help="pixels per bit, default 1")
+  parser.add_argument("maxwidth",nargs='?',type=int,default=0,help="width of the image, 0 (default) for all")
+  parser.add_argument("--format",choices=sorted(image_formats.keys()),default='rgb',help="image mode, default rgb")
+  parser.add_argument("--compress-level",type=int,choices=range(10),default=png_compress_level)
+  parser.add_argument("--pipeline",action='store_true',help="compute and write the b-file in processes of their own")
+  parser.add_argument("--processes",type=int,default=None,help="size of the process pool for 'all'")
+  parser.add_argument("--arg",action='append',default=[],metavar="VALUE",
+                      help="argument given before rows, e.g. the prime for quadratic_residue_triangle")
+  parser.add_argument("--check-import-time",type=float,metavar="SECONDS",
+                      help="only check that importing this module takes at most SECONDS and has no side effects")
+  args = parser.parse_args(argv)
+
+  if args.check_import_time is not None:
+    return(int(not check_import_time(args.check_import_time)))
+  if args.seqid is None: parser.error("give the sequence to draw, or 'all'")
+
+  image_mode = image_formats[args.format]
+  png_compress_level = args.compress_level
+  use_pipeline = args.pipeline
+
+  if 'all' == args.seqid:
+    results = run_batch(batch_all_jobs(args.rows,args.scale,args.maxwidth),args.processes)
+    return(int(any([r[3] for r in results])))
+
+  seqid = args.seqid
+  if seqid[0].isdigit(): seqid = 'A' + seqid
+  if ("do_it_for_" + seqid) not in globals(): parser.error("no function do_it_for_" + seqid)
+  fun = globals()["do_it_for_" + seqid]
+  params = fun.func_code.co_varnames[:fun.func_code.co_argcount]
+  leading = params[:list(params).index('upto_n')]
+  if args.arg and not leading: parser.error("do_it_for_" + seqid + " takes no --arg values")
+  if len(args.arg) != len(leading):
+    parser.error("do_it_for_" + seqid + " needs " + str(len(leading)) + " --arg value(s) before rows: " + ', '.join(leading))
+  values = [(int(x) if x.isdigit() else x) for x in args.arg]
+  fun(*(values + [args.rows,args.scale,args.maxwidth]))
+  return(0)
+
+
+if __name__ == '__main__':
+  import sys
+  sys.exit(main())
+
 
 
 ########################################################################